@@ -1,22 +1,22 @@
-import os
+import sys
 from pathlib import Path
 
-from dotenv import load_dotenv
-from openai import OpenAI
+# client_factory lives one directory up
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import client_factory
+import response_cache
 
-path = Path("D:\Github Repos\OpenAI-Api-Shenanigans\OpenAI-API\Environment-Variables/.env")
-load_dotenv(dotenv_path=path)
+# Set up OpenAI client (shared with the rest of the project)
+client = client_factory.get_client()
 
-# Set up OpenAI client
-client = OpenAI(
-    api_key=os.getenv("api_key")
-)
-
-def convertProblemToEquation(orgKey, apiKey):
+def convertProblemToEquation(orgKey, apiKey, use_cache=True):
     # Note: orgKey parameter is deprecated but kept for backward compatibility
-    local_client = OpenAI(api_key=apiKey)
+    # Reuses the pooled client for this key instead of opening a new connection every call
+    local_client = client_factory.get_client(apiKey)
     word_problem = input("Enter a word problem: ")
-    response = local_client.chat.completions.create(
+    response = response_cache.cached_completion(
+        local_client,
+        use_cache=use_cache,
         model="gpt-3.5-turbo",
         messages=[
             {
@@ -33,10 +33,12 @@ def convertProblemToEquation(orgKey, apiKey):
     )
     return response.choices[0].message.content
 
-def extractEquation(response, orgKey, apiKey):
+def extractEquation(response, orgKey, apiKey, use_cache=True):
     # Note: orgKey parameter is deprecated but kept for backward compatibility
-    local_client = OpenAI(api_key=apiKey)
-    result = local_client.chat.completions.create(
+    local_client = client_factory.get_client(apiKey)
+    result = response_cache.cached_completion(
+        local_client,
+        use_cache=use_cache,
         model="gpt-3.5-turbo",
         messages=[
             {
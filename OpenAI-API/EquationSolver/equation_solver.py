@@ -1,19 +1,29 @@
 # wolfram alpha API
 import wolframalpha
 import os
+import sys
 from pathlib import Path
 
 from dotenv import load_dotenv
 
+# instrumentation lives one directory up
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import instrumentation
+
 # Still have no idea why this works but hey I'm not complaining
 path = Path("Environment-Variables/.env")
 load_dotenv(dotenv_path=path)
 
-# Setting the API Key
-client = wolframalpha.Client(os.getenv("wlf_appid"))
+# Setting the API Key, and optionally a different endpoint (e.g. the stand-in from fake_server.py)
+if os.getenv("wlf_base_url"):
+    client = wolframalpha.Client(os.getenv("wlf_appid"), url=os.getenv("wlf_base_url"))
+else:
+    client = wolframalpha.Client(os.getenv("wlf_appid"))
 
 
 # Quick and dirty way of solving equations
 def solveEquation(equation):
-    response = client.query(equation)
+    # Not an OpenAI client, so it's timed here rather than by client_factory
+    with instrumentation.track("wolfram.query"):
+        response = client.query(equation)
     return next(response.results).text
@@ -2,9 +2,15 @@
 class ChatGPT:
     # Same old imports
     import os
+    import sys
     from pathlib import Path
     from dotenv import load_dotenv
-    from openai import OpenAI
+
+    # client_factory and token_splitter live one directory up
+    sys.path.append(str(Path(__file__).resolve().parent.parent))
+    import client_factory
+    import response_cache
+    import token_splitter
 
     # Load the environment variables
     path = Path("EquationSolver/Environment-Variables/.env")
@@ -15,25 +21,35 @@ class ChatGPT:
 
     # Initialize the class
     def __init__(self):
-        self.client = self.OpenAI(api_key=self.APIKEY)
+        self.client = self.client_factory.get_client(self.APIKEY)
 
     # Function to convert the problem to an equation (switched from davinci-003 to gpt-3.5-turbo)
     # Prompt design is especially important here
-    def convertProblemToEquation(self):
+    # Identical word problems are answered from the response cache unless use_cache is False
+    def convertProblemToEquation(self, use_cache=True):
         word_problem = input("Enter a word problem: ")
-        response = self.client.chat.completions.create(
+        instructions = "Use the word problem from below to create an arithmetic equation(s), using any numerical figures from the question. You may create multiple equations if required to answer the question." \
+                       "Respond with only mathematical equation(s) and no text whatsoever. Ensure that the equation(s) you provide can be directly entered into a tool like " \
+                       "symbolab to obtain an answer. Include brackets wherever needed for clarity. \n"
+
+        # Catch word problems that would overflow the context before sending them
+        plan = self.token_splitter.plan_request("gpt-3.5-turbo", instructions, word_problem, completion_tokens=64)
+        if not plan["fits"]:
+            raise ValueError(f"Word problem is {plan['payload_tokens']} tokens, only {plan['payload_budget']} fit")
+
+        response = self.response_cache.cached_completion(
+            self.client,
+            use_cache=use_cache,
             model="gpt-3.5-turbo",
             messages=[
                 {
                     "role": "user",
-                    "content": "Use the word problem from below to create an arithmetic equation(s), using any numerical figures from the question. You may create multiple equations if required to answer the question."
-                               "Respond with only mathematical equation(s) and no text whatsoever. Ensure that the equation(s) you provide can be directly entered into a tool like "
-                               "symbolab to obtain an answer. Include brackets wherever needed for clarity. \n" + word_problem
+                    "content": instructions + word_problem
                 }
             ],
             # prompt="Use the word problem from below to create an equation, using any numerical figures from the question. Respond with only a mathematical equation and no text whatsoever. I do not need any explanatory text accompanying the equation. \n" + word_problem,
             temperature=0.3,
-            max_tokens=64,
+            max_tokens=plan["completion_tokens"],
             top_p=1,
             frequency_penalty=0,
             presence_penalty=0,
@@ -12,5 +12,5 @@ equation_pass_1 = convertor.convertProblemToEquation()
 print("Equation: " + equation_pass_1)
 
 # Solve the equation
-solution = EquationSolver.solveEquation(equation_pass_1)
+solution = equation_solver.solveEquation(equation_pass_1)
 print("Solution: " + solution)
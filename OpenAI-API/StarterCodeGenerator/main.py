@@ -3,8 +3,8 @@
 # Intention is to help kickstart the coding process and/or start off the process of building a frontend
 # Integrate the batch API down the line if results aren't needed immediately
 
-from openai import OpenAI
 import os
+import sys
 from pathlib import Path
 from dotenv import load_dotenv
 import base64
@@ -13,10 +13,12 @@ import requests
 path = Path("/Environment-Variables/.env")
 load_dotenv(dotenv_path=path)
 
-# Initialize openai object
-client = OpenAI(
-    api_key=os.getenv('api_key')
-)
+# client_factory lives one directory up
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import client_factory
+
+# Initialize openai object (shared with the rest of the project)
+client = client_factory.get_client(os.getenv('api_key'))
 
 
 
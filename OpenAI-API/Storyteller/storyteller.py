@@ -1,17 +1,14 @@
-import os
+import sys
 from pathlib import Path
 import file_operations as fo
-from dotenv import load_dotenv
-from openai import OpenAI
 
-# Get environment variables
-path = Path("Environment-Variables/.env")
-load_dotenv(dotenv_path=path)
+# client_factory and streaming live one directory up
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import client_factory
+import streaming
 
-# Setup OpenAI client
-client = OpenAI(
-    api_key=os.getenv("api_key")
-)
+# Setup OpenAI client (shared with the rest of the project)
+client = client_factory.get_client()
 
 # Get category
 category = input("What category would you like to generate a story from? ")
@@ -22,15 +19,14 @@ prompt = "Use the following prompt to generate an interactive story. Ask a quest
 
 conversation_history = [{"role": "user", "content": prompt}]
 
-# Set up the starting GPT prompt
-response = client.chat.completions.create(
+# Set up the starting GPT prompt, printing the response as it's generated
+reply, ttft = streaming.stream_chat(
+    client,
     model="gpt-3.5-turbo-1106",
     messages=conversation_history
 )
-
-# Print the response
-print(response.choices[0].message.content)
-conversation_history.append({"role": "system", "content": response.choices[0].message.content})
+streaming.report_ttft(ttft, "story")
+conversation_history.append({"role": "system", "content": reply})
 
 # Start the user/GPT interaction
 while True:
@@ -40,13 +36,12 @@ while True:
     conversation_history.append({"role": "user", "content": user_response})
     print(conversation_history)
 
-    # Generate a response from GPT
-    response = client.chat.completions.create(
+    # Generate a response from GPT, printing it as it's generated
+    reply, ttft = streaming.stream_chat(
+        client,
         model="gpt-3.5-turbo-1106",
         messages=conversation_history
     )
+    streaming.report_ttft(ttft, "story")
 
-    # Print the response
-    print(response.choices[0].message.content)
-
-    conversation_history.append({"role": "system", "content": response.choices[0].message.content})
+    conversation_history.append({"role": "system", "content": reply})
@@ -0,0 +1,188 @@
+# Offline comparison of the two ways of summarizing a transcript: summarizer.py's three chained passes
+# (summarize, clarify, add detail) and fused.py's single structured call. Both run over every transcript in a
+# corpus, one after the other so they don't slow each other down, and for each transcript the report has:
+#
+#   latency      wall time of each mode
+#   tokens       prompt and completion tokens each mode used, from the instrumentation records
+#   similarity   cosine similarity of the two outputs' term counts (1.0 = same words in the same proportions)
+#   overlap      share of the three-pass output's terms that the fused output also has
+#   key terms    share of the transcript's most frequent terms that made it into each output
+#
+# A fused reply that was cut off or malformed is reported as failed (with its error) and left out of the scores,
+# rather than scored as if it were a summary.
+#
+#   python compare_modes.py transcripts/ --model gpt-4-1106-preview --output comparison.jsonl
+#
+# The scores are lexical, so they only say the fused output covers the same ground, not that it reads as well.
+
+import argparse
+import asyncio
+import functools
+import json
+import math
+import re
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+# instrumentation lives one directory up
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import fused
+import instrumentation
+
+MODES = ("three_pass", "fused")
+KEY_TERMS = 50
+
+STOPWORDS = {
+    "the", "and", "for", "are", "but", "not", "you", "your", "all", "any", "can", "had", "her", "was", "one", "our",
+    "out", "has", "have", "him", "his", "how", "its", "may", "new", "now", "see", "two", "who", "did", "get", "let",
+    "say", "she", "too", "use", "that", "this", "with", "from", "they", "will", "would", "there", "their", "what",
+    "about", "which", "when", "make", "like", "just", "into", "than", "then", "them", "these", "some", "could",
+    "been", "also", "more", "such", "only", "very", "each", "were", "being", "should", "because", "where", "while",
+    "here", "well", "does", "doing", "over", "other", "those", "much", "many", "most", "even", "through", "going",
+}
+
+_TERM = re.compile(r"[a-z][a-z0-9+#]*(?:['-][a-z0-9]+)*")
+
+
+# The fused mode doesn't fall back to the three passes here, or the comparison would be of three passes with itself
+SUMMARIZERS = {"three_pass": fused.three_pass, "fused": functools.partial(fused.summarize, fallback=False)}
+
+
+def terms(text):
+    return Counter(term for term in _TERM.findall(text.lower()) if len(term) > 2 and term not in STOPWORDS)
+
+
+def cosine(a, b):
+    dot = sum(count * b[term] for term, count in a.items())
+    norm = math.sqrt(sum(count * count for count in a.values())) * math.sqrt(sum(count * count for count in b.values()))
+    return dot / norm if norm else 0.0
+
+
+# Share of the reference terms that appear in text_terms
+def coverage(reference, text_terms):
+    reference = set(reference)
+    return len(reference & text_terms.keys()) / len(reference) if reference else 0.0
+
+
+# Run one mode on one transcription, returning its output (None if it failed), wall time and token usage
+async def _run_mode(mode, transcription, model):
+    label = f"compare.{mode}"
+    before = instrumentation.recorder.summary().get(label, {})
+    start = time.perf_counter()
+    error = None
+    with instrumentation.entry_point(label):
+        try:
+            output = await SUMMARIZERS[mode](transcription, model)
+        except ValueError as failure:
+            output, error = None, str(failure)
+    latency = time.perf_counter() - start
+    after = instrumentation.recorder.summary().get(label, {})
+    usage = {name: after.get(name, 0) - before.get(name, 0) for name in ("calls", "prompt_tokens", "completion_tokens")}
+    return output, {"latency": latency, **usage, "error": error}
+
+
+async def compare(transcription, model=fused.DEFAULT_MODEL, key_terms=KEY_TERMS):
+    outputs, row = {}, {}
+    for mode in MODES:
+        outputs[mode], row[mode] = await _run_mode(mode, transcription, model)
+
+    source_terms = [term for term, _ in terms(transcription).most_common(key_terms)]
+    mode_terms = {mode: terms(output) for mode, output in outputs.items() if output is not None}
+    for mode in MODES:
+        row[mode]["key_terms"] = coverage(source_terms, mode_terms[mode]) if mode in mode_terms else None
+    if len(mode_terms) == len(MODES):
+        row["similarity"] = cosine(mode_terms["three_pass"], mode_terms["fused"])
+        row["overlap"] = coverage(mode_terms["three_pass"], mode_terms["fused"])
+    else:
+        row["similarity"] = row["overlap"] = None
+    return row, outputs
+
+
+# Transcripts to compare: files as given, and every .txt file in any directory given
+def corpus(paths):
+    for path in map(Path, paths):
+        if path.is_dir():
+            yield from sorted(path.glob("*.txt"))
+        else:
+            yield path
+
+
+async def run(paths, model=fused.DEFAULT_MODEL, key_terms=KEY_TERMS, output_path=None, outputs_dir=None):
+    rows = []
+    output_file = open(output_path, "w", encoding="utf-8") if output_path else None
+    try:
+        for path in corpus(paths):
+            transcription = path.read_text(encoding="utf-8")
+            row, outputs = await compare(transcription, model, key_terms)
+            row = {"transcript": str(path), **row}
+            rows.append(row)
+            print_row(row)
+            if output_file:
+                output_file.write(json.dumps(row) + "\n")
+                output_file.flush()
+            if outputs_dir:
+                Path(outputs_dir).mkdir(parents=True, exist_ok=True)
+                for mode, text in outputs.items():
+                    if text is not None:
+                        (Path(outputs_dir) / f"{path.stem}.{mode}.txt").write_text(text, encoding="utf-8")
+    finally:
+        if output_file:
+            output_file.close()
+    return rows
+
+
+def print_row(row):
+    print(row["transcript"])
+    for mode, label in (("three_pass", "three-pass:"), ("fused", "fused:")):
+        result = row[mode]
+        outcome = f"FAILED ({result['error']})" if result["error"] else f"key terms {result['key_terms']:.0%}"
+        print(f"  {label:<11} {result['latency']:.1f}s, {result['calls']} calls, {result['prompt_tokens']} prompt + "
+              f"{result['completion_tokens']} completion tokens, {outcome}")
+    if row["similarity"] is not None:
+        print(f"  similarity {row['similarity']:.2f}, fused has {row['overlap']:.0%} of the three-pass terms")
+
+
+def print_totals(rows):
+    if not rows:
+        print("No transcripts found")
+        return
+
+    def total(mode, name):
+        return sum(row[mode][name] for row in rows)
+
+    three_tokens = total("three_pass", "prompt_tokens") + total("three_pass", "completion_tokens")
+    fused_tokens = total("fused", "prompt_tokens") + total("fused", "completion_tokens")
+    failed = sum(row["fused"]["error"] is not None for row in rows)
+    print(f"\n{len(rows)} transcripts: fused took {total('fused', 'latency'):.1f}s against "
+          f"{total('three_pass', 'latency'):.1f}s and {fused_tokens} tokens against {three_tokens}; "
+          f"{failed} fused replies were cut off or malformed")
+    scored = [row for row in rows if row["similarity"] is not None]
+    if scored:
+        def mean(values):
+            values = list(values)
+            return sum(values) / len(values)
+
+        print(f"Over the {len(scored)} scored: mean similarity {mean(row['similarity'] for row in scored):.2f}, "
+              f"mean overlap {mean(row['overlap'] for row in scored):.0%}, key terms "
+              f"{mean(row['fused']['key_terms'] for row in scored):.0%} fused vs "
+              f"{mean(row['three_pass']['key_terms'] for row in scored):.0%} three-pass")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare three-pass and fused summaries over a corpus")
+    parser.add_argument("paths", nargs="+", help="transcript files, or directories of .txt transcripts")
+    parser.add_argument("--model", default=fused.DEFAULT_MODEL)
+    parser.add_argument("--key-terms", type=int, default=KEY_TERMS,
+                        help="most frequent transcript terms checked for in each output")
+    parser.add_argument("--output", help="JSONL file for a row per transcript")
+    parser.add_argument("--outputs-dir", help="directory to save both modes' summaries in, for reading side by side")
+    args = parser.parse_args(argv)
+
+    rows = asyncio.run(run(args.paths, args.model, args.key_terms, args.output, args.outputs_dir))
+    print_totals(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# Fused summarization: summarizer.py's summarize, clarify and add-detail passes asked for in one structured call.
+# The model returns every bullet point with its clarification and detail as JSON, which is rendered into the
+# paragraphs the third pass would have written. One round trip instead of three, and the summary is never sent
+# back up to be clarified and then sent up again to be detailed.
+#
+# Everything has to fit in one completion, so a reply cut off at the token limit (or that isn't the JSON asked for)
+# isn't used: summarize falls back to the three passes instead, or raises with fallback=False.
+#
+#   python fused.py transcription.txt
+#
+# Whether the single call gives up anything against the three passes depends on the transcripts; compare_modes.py
+# runs both over a corpus and reports latency, tokens and how close the outputs are.
+
+import argparse
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+# async_api, client_factory and token_splitter live one directory up
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import async_api
+import client_factory
+import map_reduce
+import token_splitter
+
+DEFAULT_MODEL = "gpt-4-1106-preview"
+# The three passes get a completion each, so the one call asks for as much as the model will give it
+COMPLETION_TOKENS = 3 * 4096
+
+FUSED_PROMPT = async_api.SUMMARY_PROMPT + \
+    "Then clarify each bullet point, and add as much detail as you can to each one. Respond with JSON of the form " \
+    '{"points": [{"point": "...", "clarification": "...", "detail": "..."}]}, one entry per bullet point in ' \
+    "order, where point is the bullet point itself and detail is one or more paragraphs.\n"
+
+
+# The JSON reply as text: each bullet point followed by its clarification and detail paragraphs.
+# Raises ValueError if the reply isn't the expected JSON.
+def render(content):
+    try:
+        points = json.loads(content).get("points")
+    except (json.JSONDecodeError, AttributeError):
+        points = None
+    if not isinstance(points, list):
+        raise ValueError("Fused reply isn't JSON with a list of points")
+
+    sections = []
+    for entry in points:
+        if not isinstance(entry, dict):
+            continue
+        point, clarification, detail = (str(entry.get(name) or "").strip()
+                                        for name in ("point", "clarification", "detail"))
+        section = [f"- {point}"] if point else []
+        section += [text for text in (clarification, detail) if text]
+        if section:
+            sections.append("\n\n".join(section))
+    if not sections:
+        raise ValueError("Fused reply has no points")
+    return "\n\n".join(sections)
+
+
+# The transcription summarized, clarified and detailed in three calls, the way summarizer.py does it.
+# `reduced` is a map-reduce summary of the transcription already made, used instead of making it again.
+async def three_pass(transcription, model=DEFAULT_MODEL, reduced=None):
+    plan = token_splitter.plan_request(model, async_api.SUMMARY_PROMPT, transcription, 4096)
+    if plan["fits"]:
+        summary = await async_api.summarize(transcription, model)
+    elif reduced is not None:
+        summary = reduced
+    else:
+        summary, _ = await map_reduce.summarize(transcription, (model,))
+    clarified = await async_api.clarify(summary, model)
+    return await async_api.add_detail(clarified, model)
+
+
+# One fused call, rendered. Raises ValueError if the reply was cut off or isn't the JSON asked for.
+async def _fused_call(text, model, completion_tokens):
+    # The client is called directly rather than through async_api.chat, for the finish reason
+    async with client_factory.get_request_semaphore():
+        response = await client_factory.get_async_client().chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "user", "content": FUSED_PROMPT},
+                {"role": "user", "content": text}
+            ],
+            response_format={"type": "json_object"},
+            max_tokens=completion_tokens
+        )
+    choice = response.choices[0]
+    if choice.finish_reason == "length":
+        raise ValueError(f"Fused reply was cut off at {completion_tokens} tokens")
+    return render(choice.message.content)
+
+
+# Summarize, clarify and detail a transcription in one call. A transcription too long for that is brought down
+# to a summary with map-reduce first, and the summary is clarified and detailed in the one call instead.
+# If the reply is cut off or malformed, the three passes are run instead, or ValueError is raised if not fallback.
+async def summarize(transcription, model=DEFAULT_MODEL, completion_tokens=COMPLETION_TOKENS, fallback=True):
+    plan = token_splitter.plan_request(model, FUSED_PROMPT, transcription, completion_tokens)
+    text = transcription
+    reduced = None
+    if not plan["fits"]:
+        text = reduced = (await map_reduce.summarize(transcription, (model,)))[0]
+        plan = token_splitter.plan_request(model, FUSED_PROMPT, text, completion_tokens)
+
+    try:
+        return await _fused_call(text, model, plan["completion_tokens"])
+    except ValueError as error:
+        if not fallback:
+            raise
+        print(f"[{error}; running the three passes instead]", file=sys.stderr)
+        # The map-reduce summary is the same one the three passes would start from, so it isn't made twice
+        return await three_pass(transcription, model, reduced)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize, clarify and detail a transcript in a single call")
+    parser.add_argument("transcript", nargs="?", default="transcription.txt")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    args = parser.parse_args(argv)
+
+    with open(args.transcript, encoding="utf-8") as f:
+        transcription = f.read()
+    print(asyncio.run(summarize(transcription, args.model)))
+
+
+if __name__ == "__main__":
+    main()
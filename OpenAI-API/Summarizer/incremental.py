@@ -0,0 +1,142 @@
+# Incremental summarization for transcripts that keep growing, like a live lecture. Every chunk summary and every
+# merge map_reduce makes is cached under a hash of exactly what it was made from (prompt version, prompt, model,
+# input text, summary size and sampling parameters), so a re-run only summarizes the chunks that are new or changed
+# and redoes the merges above them; everything else is read back from the cache.
+#
+#   python incremental.py transcription.txt            -> summarize, reusing whatever it can
+#   python incremental.py transcription.txt --verify   -> also recompute everything from scratch and compare
+#
+# Since the cache is keyed on inputs, a re-run sends exactly the requests a full recompute would, minus the cached
+# ones, and ends up with the same tree of summaries. Calls are made at temperature 0 so that a full recompute
+# reproduces them as closely as the model allows.
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import threading
+from pathlib import Path
+
+# response_cache lives one directory up
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import map_reduce
+import response_cache
+
+DEFAULT_PATH = Path(os.getenv("openai_summary_cache", response_cache.CACHE_DIR / "chunk_summaries.sqlite3"))
+# Bump when something that changes the summaries isn't part of the key already (the prompts themselves are)
+PROMPT_VERSION = 1
+DEFAULT_PARAMS = {"temperature": 0}
+
+
+class SummaryCache:
+    def __init__(self, path=DEFAULT_PATH, prompt_version=PROMPT_VERSION, refresh=False, max_entries=100000):
+        """
+        Args:
+            path: SQLite file to keep the summaries in (created if missing)
+            prompt_version: Part of every key, so summaries from older prompts are never reused
+            refresh: Ignore cached summaries (but still store new ones), for a full recompute
+            max_entries: Most summaries to keep before evicting the least recently used
+        """
+        self.prompt_version = prompt_version
+        self.refresh = refresh
+        self.store = response_cache.ResponseCache(path, max_entries=max_entries, max_bytes=None)
+        # Summaries reused and made at each level (0 is the chunks, then each round of merges)
+        self.reused = []
+        self.made = []
+        self._lock = threading.Lock()
+
+    def key(self, prompt, text, model, summary_tokens, **params):
+        payload = json.dumps({"version": self.prompt_version, "prompt": prompt, "text": text, "model": model,
+                              "summary_tokens": summary_tokens, "params": params},
+                             sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _count(self, counts, level):
+        with self._lock:
+            while len(counts) <= level:
+                counts.append(0)
+            counts[level] += 1
+
+    def get(self, key, level=0):
+        summary = None if self.refresh else self.store.get(key)
+        self._count(self.made if summary is None else self.reused, level)
+        return None if summary is None else summary.decode("utf-8")
+
+    def set(self, key, summary):
+        self.store.set(key, summary)
+
+    def stats(self):
+        with self._lock:
+            reused, made = list(self.reused), list(self.made)
+        levels = max(len(reused), len(made))
+        reused += [0] * (levels - len(reused))
+        made += [0] * (levels - len(made))
+        return {
+            "chunks_reused": reused[0] if levels else 0,
+            "chunks_summarized": made[0] if levels else 0,
+            "merges_reused": sum(reused[1:]),
+            "merges_made": sum(made[1:]),
+            "reused_per_level": reused,
+            "made_per_level": made,
+        }
+
+    def close(self):
+        self.store.close()
+
+
+_cache = None
+
+
+# Shared cache at DEFAULT_PATH, opened on first use
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = SummaryCache()
+    return _cache
+
+
+# Summarize a transcription with map-reduce, reusing cached chunk summaries and merges
+async def summarize(transcription, models=map_reduce.DEFAULT_MODELS, cache=None, **settings):
+    return await map_reduce.summarize(transcription, models, cache=cache or get_cache(),
+                                      **{**DEFAULT_PARAMS, **settings})
+
+
+def report(cache, file=sys.stderr):
+    stats = cache.stats()
+    print(f"[{stats['chunks_reused']} of {stats['chunks_reused'] + stats['chunks_summarized']} chunk summaries "
+          f"reused, {stats['chunks_summarized']} summarized; {stats['merges_reused']} merges reused, "
+          f"{stats['merges_made']} redone]", file=file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize a growing transcript, reusing earlier chunk summaries")
+    parser.add_argument("transcript", nargs="?", default="transcription.txt")
+    parser.add_argument("--models", nargs="+", default=list(map_reduce.DEFAULT_MODELS),
+                        help="model per level, starting with the chunk summaries; the last one repeats")
+    parser.add_argument("--cache", default=DEFAULT_PATH, help="SQLite file the summaries are kept in")
+    parser.add_argument("--rebuild", action="store_true", help="ignore cached summaries and replace them")
+    parser.add_argument("--verify", action="store_true",
+                        help="recompute every summary without the cache and check the result matches")
+    args = parser.parse_args(argv)
+
+    with open(args.transcript, encoding="utf-8") as f:
+        transcription = f.read()
+    cache = SummaryCache(args.cache, refresh=args.rebuild)
+    summary, _ = asyncio.run(summarize(transcription, args.models, cache))
+    print(summary)
+    report(cache)
+
+    if args.verify:
+        full, _ = asyncio.run(map_reduce.summarize(transcription, args.models, **DEFAULT_PARAMS))
+        if full == summary:
+            print("[verified: a full recompute gives the same summary]", file=sys.stderr)
+        else:
+            print("[a full recompute gives a different summary; the model isn't deterministic for these "
+                  "requests, or the cache holds summaries from changed settings (try --rebuild)]", file=sys.stderr)
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
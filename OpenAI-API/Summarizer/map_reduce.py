@@ -0,0 +1,139 @@
+# Map-reduce summarization for transcripts of any length. The transcript is split into token-bounded chunks,
+# every chunk is summarized concurrently (map), and the partial summaries are merged fan_in at a time, level after
+# level, until a single summary is left (reduce). Nothing is ever cut off or sent over a model's context window.
+#
+#   python map_reduce.py transcription.txt --fan-in 4 --concurrency 8 --models gpt-3.5-turbo gpt-4-1106-preview
+#
+# --models picks the model per level: the first one summarizes the chunks, the next merges the first level of
+# summaries, and so on, with the last one used for every level after that. A cheap fast model for the many map
+# calls and a stronger one for the few merges is the usual choice.
+#
+# Chunks are cut greedily from the start and summaries are merged in order, so appending to a transcript only
+# changes its last chunk and the merges above it. Given a cache (incremental.py), every other summary is reused.
+
+import argparse
+import asyncio
+import io
+import sys
+from pathlib import Path
+
+# async_api and token_splitter live one directory up
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import async_api
+import token_splitter
+
+MAP_PROMPT = async_api.SUMMARY_PROMPT
+REDUCE_PROMPT = "These are bullet point summaries of consecutive parts of one transcript, in order. Merge them into " \
+                "a single bullet point summary for a university student, keeping every piece of advice and " \
+                "technical programming term, and dropping anything repeated between parts.\n"
+
+DEFAULT_MODELS = ("gpt-4-1106-preview",)
+# Most transcript tokens per chunk. Smaller chunks mean more of them to run side by side, and a more detailed
+# summary, since each one gets its own summary_tokens to be described in.
+CHUNK_TOKENS = 4000
+# Completion tokens allowed for each partial and merged summary; must be well under the chunk size, or merging
+# would never shrink anything
+SUMMARY_TOKENS = 1024
+
+
+def _level_model(models, level):
+    return models[min(level, len(models) - 1)]
+
+
+# The transcript as chunks of at most chunk_tokens, never more than fits next to the prompt and the summary
+def split_transcript(transcription, model, chunk_tokens=CHUNK_TOKENS, summary_tokens=SUMMARY_TOKENS):
+    plan = token_splitter.plan_request(model, MAP_PROMPT, "", summary_tokens)
+    chunk_tokens = min(chunk_tokens, plan["payload_budget"])
+    return list(token_splitter.iter_text_chunks(io.StringIO(transcription), model, chunk_tokens))
+
+
+# Group summaries, in order, into runs of at most fan_in that each fit in the model's budget for one merge
+def group_summaries(summaries, model, fan_in, summary_tokens=SUMMARY_TOKENS):
+    budget = token_splitter.plan_request(model, REDUCE_PROMPT, "", summary_tokens)["payload_budget"]
+    sizes = token_splitter.count_tokens_batch(model, summaries)
+    groups, group, group_tokens = [], [], 0
+    for summary, size in zip(summaries, sizes):
+        # Summaries are joined with a blank line, which costs about a token each
+        size += 1
+        if group and (len(group) == fan_in or group_tokens + size > budget):
+            groups.append(group)
+            group, group_tokens = [], 0
+        group.append(summary)
+        group_tokens += size
+    if group:
+        groups.append(group)
+    return groups
+
+
+# The cache is SQLite, so it's read and written from a worker thread rather than blocking the event loop
+async def _summarize(prompt, text, model, summary_tokens, semaphore, level=0, cache=None, **params):
+    if cache is not None:
+        key = cache.key(prompt, text, model, summary_tokens, **params)
+        summary = await asyncio.to_thread(cache.get, key, level)
+        if summary is not None:
+            return summary
+
+    async with semaphore:
+        summary = await async_api.chat(model, [
+            {"role": "user", "content": prompt},
+            {"role": "user", "content": text}
+        ], max_tokens=summary_tokens, **params)
+
+    if cache is not None:
+        await asyncio.to_thread(cache.set, key, summary)
+    return summary
+
+
+# Summarize a transcript of any length. Returns the summary and the number of summaries at each level.
+# With a cache (incremental.SummaryCache), summaries of unchanged chunks and merges come from it instead of a call.
+async def summarize(transcription, models=DEFAULT_MODELS, fan_in=4, concurrency=8, chunk_tokens=CHUNK_TOKENS,
+                    summary_tokens=SUMMARY_TOKENS, cache=None, **params):
+    if fan_in < 2:
+        raise ValueError("fan_in must be at least 2, or the summaries would never be merged")
+    # Bounds this summarizer's own calls; client_factory's in-flight limit still applies on top
+    semaphore = asyncio.Semaphore(concurrency)
+
+    model = _level_model(models, 0)
+    chunks = split_transcript(transcription, model, chunk_tokens, summary_tokens)
+    if not chunks:
+        raise ValueError("Transcription is empty, there's nothing to summarize")
+    summaries = await asyncio.gather(*(_summarize(MAP_PROMPT, chunk, model, summary_tokens, semaphore, 0, cache,
+                                                  **params) for chunk in chunks))
+    calls = [len(chunks)]
+
+    level = 1
+    while len(summaries) > 1:
+        model = _level_model(models, level)
+        groups = group_summaries(summaries, model, fan_in, summary_tokens)
+        if len(groups) == len(summaries):
+            raise ValueError(f"Partial summaries are too long for {model} to merge two at a time; "
+                             f"lower summary_tokens")
+        summaries = await asyncio.gather(*(_summarize(REDUCE_PROMPT, "\n\n".join(group), model, summary_tokens,
+                                                      semaphore, level, cache, **params) for group in groups))
+        calls.append(len(groups))
+        level += 1
+    return summaries[0], calls
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize a transcript of any length with map-reduce")
+    parser.add_argument("transcript", nargs="?", default="transcription.txt")
+    parser.add_argument("--models", nargs="+", default=list(DEFAULT_MODELS),
+                        help="model per level, starting with the chunk summaries; the last one repeats")
+    parser.add_argument("--fan-in", type=int, default=4, help="most summaries merged per call")
+    parser.add_argument("--concurrency", type=int, default=8, help="most calls in flight at once")
+    parser.add_argument("--chunk-tokens", type=int, default=CHUNK_TOKENS, help="most transcript tokens per chunk")
+    parser.add_argument("--summary-tokens", type=int, default=SUMMARY_TOKENS,
+                        help="most tokens per partial or merged summary")
+    args = parser.parse_args(argv)
+
+    with open(args.transcript, encoding="utf-8") as f:
+        transcription = f.read()
+    summary, calls = asyncio.run(summarize(transcription, args.models, args.fan_in, args.concurrency,
+                                           args.chunk_tokens, args.summary_tokens))
+    print(summary)
+    print(f"[{' -> '.join(str(count) for count in calls)} calls per level]", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
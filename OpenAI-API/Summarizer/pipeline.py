@@ -0,0 +1,162 @@
+# The three summarizer passes (summarize, clarify, add detail) as a pipeline over chunks of the transcript, with
+# a bounded queue between each pass. While chunk N is in the detail pass, chunk N+1 is being clarified and chunk
+# N+2 summarized, so the total time approaches that of the slowest pass rather than the sum of all three.
+#
+#   python pipeline.py transcription.txt --chunk-tokens 2000 --queue-size 2
+#
+# Each chunk's detailed result is printed in transcript order, followed by a report of how busy each stage was and
+# how full its input queue got: a stage whose queue is always full is the bottleneck, and is the one worth giving
+# more --workers or a faster model.
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+# async_api lives one directory up
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import async_api
+import map_reduce
+
+DEFAULT_MODEL = "gpt-4-1106-preview"
+
+# (stage name, prompt) in the order summarizer.py runs them
+STAGES = [
+    ("summarize", async_api.SUMMARY_PROMPT),
+    ("clarify", async_api.CLARIFY_PROMPT),
+    ("detail", async_api.DETAIL_PROMPT),
+]
+
+
+class Stage:
+    def __init__(self, name, prompt, model, workers=1, queue_size=2):
+        """
+        Args:
+            name: Label for the report
+            prompt: Instructions sent ahead of each chunk's text
+            model: Chat model for this stage
+            workers: Chunks this stage works on at once
+            queue_size: Chunks that can wait for this stage before the stage before it has to stop
+        """
+        self.name = name
+        self.prompt = prompt
+        self.model = model
+        self.workers = workers
+        self.queue = asyncio.Queue(queue_size)
+        self.calls = 0
+        self.busy = 0.0
+        self.slowest = 0.0
+        self.max_depth = 0
+        self.depth_total = 0
+        self.depth_samples = 0
+        self.waited_to_put = 0.0
+
+    # Put an item on this stage's queue, recording how deep the queue was and how long the caller waited for room
+    async def put(self, item):
+        self.depth_total += self.queue.qsize()
+        self.depth_samples += 1
+        start = time.perf_counter()
+        await self.queue.put(item)
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+        return time.perf_counter() - start
+
+    async def run(self, next_stage, results):
+        while True:
+            item = await self.queue.get()
+            # None is the end of the input; one is queued per worker
+            if item is None:
+                self.queue.task_done()
+                return
+            index, text = item
+            start = time.perf_counter()
+            output = await async_api.chat(self.model, [
+                {"role": "user", "content": self.prompt},
+                {"role": "user", "content": text}
+            ])
+            elapsed = time.perf_counter() - start
+            self.calls += 1
+            self.busy += elapsed
+            self.slowest = max(self.slowest, elapsed)
+            if next_stage is None:
+                results[index] = output
+            else:
+                self.waited_to_put += await next_stage.put((index, output))
+            self.queue.task_done()
+
+    def report(self, wall_time):
+        average = self.busy / self.calls if self.calls else 0.0
+        mean_depth = self.depth_total / self.depth_samples if self.depth_samples else 0.0
+        utilization = self.busy / (wall_time * self.workers) if wall_time else 0.0
+        return (f"{self.name:>10}: {self.calls} calls, busy {self.busy:.1f}s ({utilization:.0%} of the run), "
+                f"avg {average * 1000:.0f} ms, slowest {self.slowest * 1000:.0f} ms, "
+                f"queue depth avg {mean_depth:.1f} max {self.max_depth}/{self.queue.maxsize}, "
+                f"blocked on the next stage {self.waited_to_put:.1f}s")
+
+
+# Run every chunk through every stage, returning the final outputs in chunk order and the stages (for their stats).
+# If any call fails, every stage is stopped and the error is raised, rather than the stages around the failed one
+# waiting forever on queues nobody reads from or writes to any more.
+async def run_pipeline(chunks, models=(DEFAULT_MODEL,), workers=1, queue_size=2):
+    stages = [Stage(name, prompt, map_reduce._level_model(models, level), workers, queue_size)
+              for level, (name, prompt) in enumerate(STAGES)]
+    results = [None] * len(chunks)
+
+    async def run_stage(index, stage):
+        next_stage = stages[index + 1] if index + 1 < len(stages) else None
+        await asyncio.gather(*(stage.run(next_stage, results) for _ in range(stage.workers)))
+        # Every worker of this stage is done, so the next stage won't get any more work
+        if next_stage is not None:
+            for _ in range(next_stage.workers):
+                await next_stage.queue.put(None)
+
+    async def feed():
+        for item in enumerate(chunks):
+            await stages[0].put(item)
+        for _ in range(stages[0].workers):
+            await stages[0].queue.put(None)
+
+    tasks = [asyncio.ensure_future(feed())]
+    tasks += [asyncio.ensure_future(run_stage(index, stage)) for index, stage in enumerate(stages)]
+    try:
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                # Raises the first failure, which cancels everything still running below
+                task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return results, stages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize, clarify and detail a transcript as a pipeline of chunks")
+    parser.add_argument("transcript", nargs="?", default="transcription.txt")
+    parser.add_argument("--models", nargs="+", default=[DEFAULT_MODEL],
+                        help="model per stage (summarize, clarify, detail); the last one repeats")
+    parser.add_argument("--chunk-tokens", type=int, default=2000, help="most transcript tokens per chunk")
+    parser.add_argument("--workers", type=int, default=1, help="chunks each stage works on at once")
+    parser.add_argument("--queue-size", type=int, default=2, help="chunks that can wait between two stages")
+    args = parser.parse_args(argv)
+
+    with open(args.transcript, encoding="utf-8") as f:
+        transcription = f.read()
+    chunks = map_reduce.split_transcript(transcription, args.models[0], args.chunk_tokens)
+
+    start = time.perf_counter()
+    results, stages = asyncio.run(run_pipeline(chunks, args.models, args.workers, args.queue_size))
+    wall_time = time.perf_counter() - start
+
+    print("\n\n".join(results))
+    sequential = sum(stage.busy for stage in stages)
+    print(f"\n{len(chunks)} chunks in {wall_time:.1f}s; the same calls one after another would take about "
+          f"{sequential:.1f}s", file=sys.stderr)
+    for stage in stages:
+        print(stage.report(wall_time), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,12 @@
-import os
+import sys
 from pathlib import Path
-from dotenv import load_dotenv
-from openai import OpenAI
 
-path = Path("../Environment-Variables/.env")
-load_dotenv(dotenv_path=path)
+# client_factory lives one directory up
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import client_factory
 
-# Set up openai client
-client = OpenAI(
-    api_key=os.getenv("api_key")
-)
+# Set up openai client (shared with the rest of the project)
+client = client_factory.get_client()
 
 
 # transcription function
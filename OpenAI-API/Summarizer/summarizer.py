@@ -1,20 +1,25 @@
+import asyncio
 import os
+import sys
 from pathlib import Path
 
-from dotenv import load_dotenv
-from openai import OpenAI
+import fused
+import incremental
+import map_reduce
 
-path = Path("../Environment-Variables/.env")
-load_dotenv(dotenv_path=path)
+# client_factory, streaming and token_splitter live one directory up
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import client_factory
+import instrumentation
+import streaming
+import token_splitter
 
-# Set up openai client
-client = OpenAI(
-    api_key=os.getenv("api_key")
-)
+# Set up openai client (shared with the rest of the project)
+client = client_factory.get_client()
 
-# Read transcription file
+# Read transcription file, all of it, however long
 with open("transcription.txt") as f:
-    transcription = f.readline()
+    transcription = f.read()
 
 # Parameter Meanings for response generation
 # temperature: Controls Randomness. Lower means less random completions. As this value approaches zero, the model becomes very deterministic
@@ -24,39 +29,80 @@ with open("transcription.txt") as f:
 # presence_penalty: Penalizes new tokens based on if they show up already. Increases the likelihood of new topics coming up
 # best_of: Generates the specified number of items and then returns the best one
 
+model = "gpt-4-1106-preview"
 prompt = "Comprehensively summarize this for a university student. Using bullet points to organize the summary, " \
          "Go through every piece of advice provided by the speaker. " \
-         "If you can use technical programming terms, be sure to reference them.\n" + transcription
+         "If you can use technical programming terms, be sure to reference them.\n"
 
-# First generation pass using davinci-003 model
-response = client.chat.completions.create(
-    model="gpt-4-1106-preview",
-    messages=[
-        {"role": "user", "content": prompt},
-    ]
-)
+# summarizer_mode=fused in the .env file asks for the summary, clarification and detail in one structured call
+# (fused.py) instead of three chained passes; compare_modes.py shows what that trades away on your transcripts
+if os.getenv("summarizer_mode", "three-pass") == "fused":
+    with instrumentation.entry_point("summarizer.fused"):
+        final_detailed = asyncio.run(fused.summarize(transcription, model))
+    print("Final Result:", final_detailed)
+    instrumentation.recorder.print_summary()
+    raise SystemExit
 
-print(response.choices[0].message.content)
+# Make sure the transcription fits next to the prompt and the completion
+plan = token_splitter.plan_request(model, prompt, transcription, completion_tokens=4096)
+
+# summarizer_incremental=true in the .env file summarizes in chunks and keeps every chunk summary (incremental.py),
+# so re-running on a transcript that's been appended to only summarizes the new part and re-merges
+INCREMENTAL = os.getenv("summarizer_incremental", "false").lower() in ("1", "true", "yes")
+
+# Each pass is streamed, so its output is printed as it's generated rather than once the pass is done
+
+# First generation pass using davinci-003 model. A transcription too long for one call is summarized
+# with map-reduce instead: its chunks are summarized side by side, then merged into one summary.
+if INCREMENTAL:
+    with instrumentation.entry_point("summarizer.summarize"):
+        summary, calls = asyncio.run(incremental.summarize(transcription, (model,)))
+    print(summary)
+    incremental.report(incremental.get_cache())
+elif plan["fits"]:
+    with instrumentation.entry_point("summarizer.summarize"):
+        summary, ttft = streaming.stream_chat(
+            client,
+            model=model,
+            messages=[
+                {"role": "user", "content": prompt},
+                {"role": "user", "content": transcription},
+            ],
+            max_tokens=plan["completion_tokens"]
+        )
+    streaming.report_ttft(ttft, "summary")
+else:
+    print(f"Transcription is {plan['payload_tokens']} tokens, summarizing it with map-reduce")
+    with instrumentation.entry_point("summarizer.summarize"):
+        summary, calls = asyncio.run(map_reduce.summarize(transcription, (model,)))
+    print(summary)
 
 # Fact Checking pass, uses same model as above
-fact_checked_response = client.chat.completions.create(
-    model="gpt-4-1106-preview",
-    messages=[
-        {"role": "user", "content": "Clarify each bullet point: "},
-        {"role": "user", "content": response.choices[0].message.content}
-    ]
-)
-print(fact_checked_response.choices[0].message.content)
+with instrumentation.entry_point("summarizer.clarify"):
+    fact_checked, ttft = streaming.stream_chat(
+        client,
+        model="gpt-4-1106-preview",
+        messages=[
+            {"role": "user", "content": "Clarify each bullet point: "},
+            {"role": "user", "content": summary}
+        ]
+    )
+streaming.report_ttft(ttft, "clarification")
 
 # Detail-addition pass, using same model as above
-final_detailed_response = client.chat.completions.create(
-    model="gpt-4-1106-preview",
-    messages=[
-        {"role": "user", "content": "Add as much detail as you can to each bullet point. Use paragraphs to organize your response."},
-        {"role": "user", "content": fact_checked_response.choices[0].message.content}
-    ]
-)
-print(final_detailed_response.choices[0].message.content)
+with instrumentation.entry_point("summarizer.detail"):
+    final_detailed, ttft = streaming.stream_chat(
+        client,
+        model="gpt-4-1106-preview",
+        messages=[
+            {"role": "user", "content": "Add as much detail as you can to each bullet point. Use paragraphs to organize your response."},
+            {"role": "user", "content": fact_checked}
+        ]
+    )
+streaming.report_ttft(ttft, "detail")
 
 # Print final response after all three passes
-print("Final Result:", final_detailed_response.choices[0].message.content)
+print("Final Result:", final_detailed)
+
+# Where the time went across the three passes
+instrumentation.recorder.print_summary()
@@ -0,0 +1,58 @@
+"""
+Test script for pipeline.py, with the API calls replaced so it runs offline
+Run this (or pytest) to check chunks come out in order and a failing stage stops the pipeline instead of hanging it
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import pipeline
+
+
+STAGE_NAMES = {prompt: name for name, prompt in pipeline.STAGES}
+
+
+# Stand-in for async_api.chat that tags the text with the stage's prompt, and fails on fail_prompt if given
+def fake_chat(fail_prompt=None):
+    async def chat(model, messages, **params):
+        prompt, text = messages[0]["content"], messages[1]["content"]
+        await asyncio.sleep(0.001)
+        if prompt == fail_prompt:
+            raise RuntimeError(f"{prompt!r} failed")
+        return f"{text}+{STAGE_NAMES[prompt]}"
+    return chat
+
+
+def test_results_in_order():
+    original = pipeline.async_api.chat
+    pipeline.async_api.chat = fake_chat()
+    try:
+        chunks = [f"chunk{i}" for i in range(20)]
+        results, stages = asyncio.run(pipeline.run_pipeline(chunks, workers=2, queue_size=1))
+    finally:
+        pipeline.async_api.chat = original
+    assert results == [f"chunk{i}+summarize+clarify+detail" for i in range(20)]
+    assert [stage.calls for stage in stages] == [20, 20, 20]
+
+
+def test_failing_stage_raises():
+    original = pipeline.async_api.chat
+    pipeline.async_api.chat = fake_chat(fail_prompt=pipeline.async_api.DETAIL_PROMPT)
+    try:
+        chunks = [f"chunk{i}" for i in range(20)]
+        # The timeout only guards the test itself; the pipeline has to fail well before it
+        asyncio.run(asyncio.wait_for(pipeline.run_pipeline(chunks, queue_size=1), 10))
+    except RuntimeError as error:
+        assert "failed" in str(error)
+    else:
+        raise AssertionError("run_pipeline returned despite a failing stage")
+    finally:
+        pipeline.async_api.chat = original
+
+
+if __name__ == "__main__":
+    for test in (test_results_in_order, test_failing_stage_raises):
+        test()
+        print(f"✓ {test.__name__}")
@@ -0,0 +1,191 @@
+# Adaptive in-flight limit for the async API layer, so nobody has to guess a MAX_IN_FLIGHT that suits both a
+# quiet night and peak hours. The limit follows AIMD (additive increase, multiplicative decrease), like TCP
+# congestion control:
+#
+#   - every request that comes back within LATENCY_TOLERANCE of the baseline (a slow-moving average of recent
+#     latencies) adds 1/limit, so the limit grows by one per full window of requests while latency stays flat
+#   - a 429, a timeout, or a request that took more than LATENCY_TOLERANCE times the baseline multiplies it by
+#     DECREASE_FACTOR, at most once per baseline latency so one burst of bad answers only counts once
+#
+# Latency is the API's own time for the attempt that answered (instrumentation's "upstream"), so rate limiter
+# sleeps and retries don't read as the API slowing down. A 500-token completion naturally takes longer than a
+# one-word one, so requests are compared against a baseline for their own kind: per model, streamed or not, and
+# completion size rounded to a power of two. Each baseline starts as the median of its first SEED_SAMPLES
+# samples, so one unusually fast or slow first answer doesn't set it.
+#
+# client_factory hands out an AdaptiveSemaphore in place of a fixed asyncio.Semaphore, so async_api callers don't
+# change, and passes every instrumentation record to on_record. Every adjustment is kept in controller.history
+# and the current limit is exported in Prometheus text.
+
+import asyncio
+import statistics
+import threading
+import time
+from collections import deque
+
+import openai
+
+DECREASE_FACTOR = 0.5
+# A request this many times slower than the baseline counts as a latency spike
+LATENCY_TOLERANCE = 2.0
+# How far each new sample pulls the baseline towards itself. Small, so a few unusually fast answers (cache hits,
+# coalesced duplicates) or slow ones don't move it much, but it still follows the API when it changes for good.
+BASELINE_DECAY = 0.02
+# Samples of a kind of request collected before its baseline is set (to their median) and spikes are judged
+SEED_SAMPLES = 10
+
+
+class ConcurrencyController:
+    def __init__(self, initial_limit=16, min_limit=1, max_limit=256, max_history=1000):
+        """
+        Args:
+            initial_limit: Requests allowed in flight before anything has been measured
+            min_limit: Lowest the limit is ever cut to
+            max_limit: Highest the limit is ever raised to
+            max_history: How many of the most recent adjustments to keep in history
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        # Baseline latency per kind of request, and the first samples of kinds still being seeded
+        self.baselines = {}
+        self._seeding = {}
+        self.in_flight = 0
+        self.increases = 0
+        self.decreases = 0
+        self.history = deque(maxlen=max_history)
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    # Whole requests currently allowed in flight
+    @property
+    def current_limit(self):
+        return int(self.limit)
+
+    # Take a slot if one is free under the current limit
+    def try_acquire(self):
+        with self._lock:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _record(self, before, reason):
+        self.history.append({"timestamp": time.time(), "limit_before": int(before), "limit": int(self.limit),
+                             "reason": reason})
+
+    # Seconds that count as one baseline for cooling down after a decrease: the median over every kind of request
+    def _cooldown(self):
+        return statistics.median(self.baselines.values()) if self.baselines else 0.0
+
+    # A request finished normally after `latency` seconds upstream. `kind` is compared with its own baseline.
+    def on_success(self, latency, kind=None):
+        with self._lock:
+            baseline = self.baselines.get(kind)
+            if baseline is None:
+                samples = self._seeding.setdefault(kind, [])
+                samples.append(latency)
+                if len(samples) >= SEED_SAMPLES:
+                    self.baselines[kind] = statistics.median(samples)
+                    del self._seeding[kind]
+                spike = False
+            else:
+                self.baselines[kind] = baseline + (latency - baseline) * BASELINE_DECAY
+                spike = latency > baseline * LATENCY_TOLERANCE
+
+            if spike:
+                self._decrease("latency")
+            # Only grow while the window is actually being used, otherwise the limit climbs with no evidence
+            # that more concurrency would be served
+            elif self.in_flight >= self.limit / 2 and self.limit < self.max_limit:
+                before = self.limit
+                self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+                if int(self.limit) != int(before):
+                    self.increases += 1
+                    self._record(before, "increase")
+
+    # An instrumentation record of a finished call: successful chat completions feed the latency baselines
+    def on_record(self, record):
+        if record["endpoint"] != "chat.completions" or record["error"] is not None or record["upstream"] is None:
+            return
+        # A stream's upstream time is to its first chunk, whatever its length
+        size = 0 if record["stream"] else (record["completion_tokens"] or 0).bit_length()
+        self.on_success(record["upstream"], (record["model"], record["stream"], size))
+
+    # The server pushed back (429 or timeout); `reason` is kept in the history
+    def on_overload(self, reason="rate_limited"):
+        with self._lock:
+            self._decrease(reason)
+
+    def _decrease(self, reason):
+        now = time.monotonic()
+        # Requests already in flight when the limit was cut report the same overload, so ignore them
+        if now - self._last_decrease < self._cooldown():
+            return
+        new_limit = max(self.limit * DECREASE_FACTOR, self.min_limit)
+        # Already as low as it goes (in whole requests, which is all the limit admits): nothing to cut or record
+        if int(new_limit) == int(self.limit):
+            return
+        before = self.limit
+        self.limit = new_limit
+        self._last_decrease = now
+        self.decreases += 1
+        self._record(before, reason)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "baseline_latency": self._cooldown() if self.baselines else None,
+                "baselines": len(self.baselines),
+                "increases": self.increases,
+                "decreases": self.decreases,
+            }
+
+    # Current limit and adjustment counts in Prometheus text exposition format
+    def prometheus_text(self):
+        stats = self.stats()
+        lines = [
+            "# HELP openai_concurrency_limit Requests the async API layer allows in flight",
+            "# TYPE openai_concurrency_limit gauge",
+            f"openai_concurrency_limit {stats['limit']}",
+            "# HELP openai_in_flight_requests Requests the async API layer has in flight",
+            "# TYPE openai_in_flight_requests gauge",
+            f"openai_in_flight_requests {stats['in_flight']}",
+            "# HELP openai_concurrency_adjustments_total Times the in-flight limit was raised or cut",
+            "# TYPE openai_concurrency_adjustments_total counter",
+            f'openai_concurrency_adjustments_total{{direction="increase"}} {stats["increases"]}',
+            f'openai_concurrency_adjustments_total{{direction="decrease"}} {stats["decreases"]}',
+        ]
+        return "\n".join(lines) + "\n"
+
+
+def _is_overload(error):
+    return isinstance(error, (openai.RateLimitError, openai.APITimeoutError))
+
+
+# Drop-in for asyncio.Semaphore that admits as many requests as the controller currently allows and reports
+# timeouts and 429s back to it. Latency comes from instrumentation records instead, since the time spent inside
+# the semaphore also covers rate limiter sleeps, retries and whatever else the caller does there.
+# Belongs to one event loop; the controller can be shared between loops.
+class AdaptiveSemaphore:
+    def __init__(self, controller):
+        self.controller = controller
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(self.controller.try_acquire)
+
+    async def __aexit__(self, exc_type, error, traceback):
+        if _is_overload(error):
+            self.controller.on_overload(type(error).__name__)
+        self.controller.release()
+        async with self._condition:
+            # The limit may have grown, so wake as many waiters as there are free slots rather than just one
+            self._condition.notify(max(self.controller.current_limit - self.controller.in_flight, 1))
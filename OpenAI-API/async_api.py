@@ -0,0 +1,161 @@
+# Coroutine versions of the API calls made around the project, built on AsyncOpenAI.
+# Every call waits on the shared semaphore from client_factory, so a single process can gather hundreds of
+# these and only ever have as many requests open at once as the in-flight limit allows (which adapts to latency
+# and 429s unless openai_adaptive_concurrency is turned off):
+#
+#   results = await asyncio.gather(*(async_api.classify_sentiment(text) for text in texts))
+
+import asyncio
+from pathlib import Path
+
+from openai.types.chat import ChatCompletion
+
+import client_factory
+import response_cache
+
+# Prompts match the ones used by the synchronous scripts
+SENTIMENT_PROMPT = "What is the sentiment of this text? Respond with one of the following: Positive, Negative, " \
+                   "Neutral, and rank it on a scale of 1 - 10 where 1 is heavily negative and 10 is heavily positive."
+EQUATION_PROMPT = "Use the word problem from below to create an arithmetic equation(s), using any numerical figures " \
+                  "from the question. You may create multiple equations if required to answer the question." \
+                  "Respond with only mathematical equation(s) and no text whatsoever. Ensure that the equation(s) " \
+                  "you provide can be directly entered into a tool like symbolab to obtain an answer. Include " \
+                  "brackets wherever needed for clarity. \n"
+SUMMARY_PROMPT = "Comprehensively summarize this for a university student. Using bullet points to organize the " \
+                 "summary, Go through every piece of advice provided by the speaker. " \
+                 "If you can use technical programming terms, be sure to reference them.\n"
+CLARIFY_PROMPT = "Clarify each bullet point: "
+DETAIL_PROMPT = "Add as much detail as you can to each bullet point. Use paragraphs to organize your response."
+
+
+# Send one chat completion through the in-flight limit and return the message text.
+# With use_cache=True, a request identical to an earlier one is answered from the response cache instead.
+# The cache is SQLite, so it's read and written from a worker thread rather than blocking the event loop.
+async def chat(model, messages, use_cache=False, **params):
+    if use_cache:
+        cache = await asyncio.to_thread(response_cache.get_cache)
+        key = response_cache.request_key(model=model, messages=messages, **params)
+        cached = await asyncio.to_thread(cache.get, key)
+        if cached is not None:
+            return ChatCompletion.model_validate_json(cached).choices[0].message.content
+
+    async with client_factory.get_request_semaphore():
+        response = await client_factory.get_async_client().chat.completions.create(
+            model=model, messages=messages, **params
+        )
+
+    if use_cache:
+        await asyncio.to_thread(cache.set, key, response.model_dump_json())
+    return response.choices[0].message.content
+
+
+# Fetch a generated image and write it to disk, over the same pooled connections as the API calls
+async def _download(url, output_path):
+    async with client_factory.get_request_semaphore():
+        response = await client_factory.get_async_http_client().get(url)
+    response.raise_for_status()
+    await asyncio.to_thread(Path(output_path).write_bytes, response.content)
+    return output_path
+
+
+# image_generator.generate_image, with the prompt passed in instead of read from input()
+async def generate_image(prompt, output_path="generated_image.jpg", model="dall-e-2", size="1024x1024"):
+    async with client_factory.get_request_semaphore():
+        response = await client_factory.get_async_client().images.generate(
+            model=model, prompt=prompt, n=1, size=size
+        )
+    return await _download(response.data[0].url, output_path)
+
+
+# image_variation.create_variation
+async def create_variation(image_path="generated_image.jpg", output_path="generated_image_revised.jpg",
+                           size="1024x1024"):
+    image = await asyncio.to_thread(Path(image_path).read_bytes)
+    async with client_factory.get_request_semaphore():
+        response = await client_factory.get_async_client().images.create_variation(
+            image=(Path(image_path).name, image), n=1, size=size
+        )
+    return await _download(response.data[0].url, output_path)
+
+
+# vision.py
+async def describe_image(image_url, prompt="What's in this image?", model="gpt-4-vision-preview", max_tokens=500):
+    return await chat(model, [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": prompt},
+                {"type": "image_url", "image_url": {"url": image_url}}
+            ]
+        }
+    ], max_tokens=max_tokens)
+
+
+# sentiment_analyzer.py
+async def classify_sentiment(text, model="gpt-4-1106-preview"):
+    return await chat(model, [
+        {"role": "user", "content": SENTIMENT_PROMPT},
+        {"role": "user", "content": text}
+    ], max_tokens=20)
+
+
+# problem_to_equation.ChatGPT.convertProblemToEquation, with the word problem passed in
+async def convert_problem_to_equation(word_problem, model="gpt-3.5-turbo", use_cache=False):
+    return await chat(model, [
+        {"role": "user", "content": EQUATION_PROMPT + word_problem}
+    ], use_cache=use_cache, temperature=0.3, max_tokens=64, top_p=1, frequency_penalty=0, presence_penalty=0, stop=["\n"])
+
+
+# The three passes from summarizer.py, each usable on its own
+async def summarize(transcription, model="gpt-4-1106-preview"):
+    return await chat(model, [
+        {"role": "user", "content": SUMMARY_PROMPT},
+        {"role": "user", "content": transcription}
+    ])
+
+
+async def clarify(summary, model="gpt-4-1106-preview"):
+    return await chat(model, [
+        {"role": "user", "content": CLARIFY_PROMPT},
+        {"role": "user", "content": summary}
+    ])
+
+
+async def add_detail(clarified, model="gpt-4-1106-preview"):
+    return await chat(model, [
+        {"role": "user", "content": DETAIL_PROMPT},
+        {"role": "user", "content": clarified}
+    ])
+
+
+# All three summarizer passes in order, returning the final detailed summary
+async def summarize_transcription(transcription, model="gpt-4-1106-preview"):
+    summary = await summarize(transcription, model)
+    clarified = await clarify(summary, model)
+    return await add_detail(clarified, model)
+
+
+# One turn of storyteller.py: sends the history and appends the reply to it
+async def continue_story(conversation_history, model="gpt-3.5-turbo-1106"):
+    reply = await chat(model, conversation_history)
+    conversation_history.append({"role": "system", "content": reply})
+    return reply
+
+
+# audio_translation.py / speech_to_text.py
+async def transcribe(audio_path, model="whisper-1"):
+    audio = await asyncio.to_thread(Path(audio_path).read_bytes)
+    async with client_factory.get_request_semaphore():
+        transcription = await client_factory.get_async_client().audio.transcriptions.create(
+            model=model, file=(Path(audio_path).name, audio)
+        )
+    return transcription.text
+
+
+async def translate(audio_path, model="whisper-1"):
+    audio = await asyncio.to_thread(Path(audio_path).read_bytes)
+    async with client_factory.get_request_semaphore():
+        translation = await client_factory.get_async_client().audio.translations.create(
+            model=model, file=(Path(audio_path).name, audio)
+        )
+    return translation.text
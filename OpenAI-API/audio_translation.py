@@ -1,18 +1,7 @@
-import os
-from pathlib import Path
+import client_factory
 
-import requests
-from dotenv import load_dotenv
-from openai import OpenAI
-
-# Get environment variables
-path = Path("Environment-Variables/.env")
-load_dotenv(dotenv_path=path)
-
-# Set up openai client
-client = OpenAI(
-    api_key=os.getenv("api_key")
-)
+# Set up openai client (shared with the rest of the project)
+client = client_factory.get_client()
 
 path = r'C:\Users\samar\Downloads\00176131.mp3'
 print(path)
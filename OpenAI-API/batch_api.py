@@ -0,0 +1,180 @@
+# Jobs for the Batch API, for work that doesn't need an answer right away (nightly sentiment runs, image prompt
+# jobs): half the price of live calls and a separate, much larger rate limit.
+#
+#   requests = [(row_id, {"model": "gpt-3.5-turbo", "messages": [...], "max_tokens": 20}) for row_id, ... in rows]
+#   results = batch_api.run_batch(requests)
+#   results[row_id]["body"]["choices"][0]["message"]["content"]
+#
+# The requests are written to JSONL input files (split so none goes over the API's per-file request and size
+# limits), uploaded and submitted, polled with backoff until they finish, and their output files streamed back and
+# matched up with the original ids (the API only takes string ids, but results come back under the ids as passed,
+# ints included). Pointing openai_base_url at fake_server.py runs the whole thing locally.
+#
+# The shared clients leave retrying to rate_limiter, which doesn't cover files and batches, so every call here
+# goes through a copy of the client with the SDK's own retries turned on. A job can poll for hours; one 5xx or
+# dropped connection shouldn't end it.
+
+import json
+import time
+from pathlib import Path
+
+import httpx
+import openai
+
+import client_factory
+
+BATCH_DIR = Path(__file__).resolve().parent / "cache" / "batches"
+
+# Limits the API puts on a single batch input file
+MAX_REQUESTS_PER_BATCH = 50000
+MAX_BATCH_FILE_BYTES = 200 * 1024 * 1024
+
+# Polling backoff: start at POLL_INTERVAL seconds and grow by POLL_BACKOFF each time, up to MAX_POLL_INTERVAL
+POLL_INTERVAL = 5.0
+POLL_BACKOFF = 1.5
+MAX_POLL_INTERVAL = 300.0
+
+FINISHED_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+# Retries for every file and batch call (5xx, 429 and connection errors, with the SDK's backoff), and for
+# resuming a result download that drops partway through
+MAX_RETRIES = 5
+
+
+def _retrying(client):
+    return (client or client_factory.get_client()).with_options(max_retries=MAX_RETRIES)
+
+
+# One line of a batch input file
+def build_request(custom_id, body, endpoint="/v1/chat/completions"):
+    return {"custom_id": str(custom_id), "method": "POST", "url": endpoint, "body": body}
+
+
+# Write (custom_id, body) pairs to as many JSONL input files as the limits call for, returning their paths.
+# Files are named <prefix>-<n>.jsonl in `directory`.
+def write_batch_files(requests, endpoint="/v1/chat/completions", directory=BATCH_DIR, prefix=None,
+                      max_requests=MAX_REQUESTS_PER_BATCH, max_bytes=MAX_BATCH_FILE_BYTES):
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    prefix = prefix or f"batch-{int(time.time())}"
+
+    paths = []
+    seen = set()
+    file = None
+    count = size = 0
+    try:
+        for custom_id, body in requests:
+            line = (json.dumps(build_request(custom_id, body, endpoint), ensure_ascii=False) + "\n").encode("utf-8")
+            if str(custom_id) in seen:
+                raise ValueError(f"Duplicate custom_id {custom_id!r}, results couldn't be told apart")
+            if len(line) > max_bytes:
+                raise ValueError(f"Request {custom_id!r} is {len(line)} bytes, more than a batch file can hold")
+            seen.add(str(custom_id))
+
+            if file is None or count == max_requests or size + len(line) > max_bytes:
+                if file is not None:
+                    file.close()
+                paths.append(directory / f"{prefix}-{len(paths) + 1}.jsonl")
+                file = open(paths[-1], "wb")
+                count = size = 0
+            file.write(line)
+            count += 1
+            size += len(line)
+    finally:
+        if file is not None:
+            file.close()
+    return paths
+
+
+# Upload an input file and start a batch on it
+def submit_batch(path, endpoint="/v1/chat/completions", completion_window="24h", metadata=None, client=None):
+    client = _retrying(client)
+    with open(path, "rb") as file:
+        input_file = client.files.create(file=file, purpose="batch")
+    return client.batches.create(input_file_id=input_file.id, endpoint=endpoint,
+                                 completion_window=completion_window, metadata=metadata)
+
+
+# Poll the batches until every one has finished, backing off between rounds. Returns {batch id: batch}.
+def wait_for_batches(batch_ids, client=None, poll_interval=POLL_INTERVAL, timeout=None):
+    client = _retrying(client)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    pending = list(batch_ids)
+    finished = {}
+    interval = poll_interval
+    while True:
+        for batch_id in list(pending):
+            batch = client.batches.retrieve(batch_id)
+            if batch.status in FINISHED_STATUSES:
+                finished[batch_id] = batch
+                pending.remove(batch_id)
+        if not pending:
+            return finished
+        if deadline is not None and time.monotonic() + interval > deadline:
+            raise TimeoutError(f"Batches still running after {timeout}s: {', '.join(pending)}")
+        time.sleep(interval)
+        interval = min(interval * POLL_BACKOFF, MAX_POLL_INTERVAL)
+
+
+# Stream a finished batch's output and error files, one parsed line at a time. A download that drops partway
+# is started again and skips the lines already read.
+def iter_batch_results(batch, client=None):
+    client = _retrying(client)
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        read = 0
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                with client.files.with_streaming_response.content(file_id) as response:
+                    for index, line in enumerate(response.iter_lines()):
+                        if index < read:
+                            continue
+                        read = index + 1
+                        if line:
+                            yield json.loads(line)
+                break
+            except (openai.APIConnectionError, httpx.TransportError):
+                if attempt == MAX_RETRIES:
+                    raise
+                time.sleep(min(2 ** attempt, MAX_POLL_INTERVAL))
+
+
+# Results of finished batches keyed by custom_id, each {"status_code": ..., "body": ..., "error": ...}.
+# `ids` maps the string custom_ids back to the ids the requests were made with; without it results are keyed by
+# the strings. Requests a batch never got to (it failed, expired or was cancelled) are missing from the dict.
+def collect_results(batches, client=None, ids=None):
+    results = {}
+    for batch in batches:
+        for line in iter_batch_results(batch, client):
+            response = line.get("response") or {}
+            custom_id = line["custom_id"]
+            results[ids.get(custom_id, custom_id) if ids else custom_id] = {
+                "status_code": response.get("status_code"),
+                "body": response.get("body"),
+                "error": line.get("error"),
+            }
+    return results
+
+
+# Write, submit and wait on a whole job, returning collect_results for it
+def run_batch(requests, endpoint="/v1/chat/completions", completion_window="24h", metadata=None, client=None,
+              poll_interval=POLL_INTERVAL, timeout=None, **file_limits):
+    client = client or client_factory.get_client()
+    # The ids as passed, under the strings they're sent as
+    ids = {}
+
+    def remember_ids(requests):
+        for custom_id, body in requests:
+            ids[str(custom_id)] = custom_id
+            yield custom_id, body
+
+    paths = write_batch_files(remember_ids(requests), endpoint, **file_limits)
+    batch_ids = [submit_batch(path, endpoint, completion_window, metadata, client).id for path in paths]
+    for batch_id, path in zip(batch_ids, paths):
+        print(f"Submitted {path.name} as {batch_id}")
+    finished = wait_for_batches(batch_ids, client, poll_interval, timeout)
+    for batch in finished.values():
+        if batch.status != "completed":
+            print(f"Batch {batch.id} finished as {batch.status}")
+    return collect_results(finished.values(), client, ids)
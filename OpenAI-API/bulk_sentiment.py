@@ -0,0 +1,258 @@
+# Bulk version of sentiment_analyzer.py for CSV or JSONL files with far too many rows to classify one at a time.
+# Records are streamed from the file and packed many to a request, up to a token budget. The model answers each
+# pack with JSON labels and scores per item, packs run concurrently under client_factory's in-flight limit, and
+# results are appended to a JSONL file as each pack finishes:
+#
+#   python bulk_sentiment.py reviews.csv --text-field review --id-field review_id -o sentiment.jsonl
+#
+# The output file doubles as the checkpoint. Rerunning the same command skips every id already labelled there,
+# so a crash or Ctrl+C only costs the packs that were in flight. Ids that failed are written with an "error" and
+# tried again on the next run, so when an id appears more than once, its last line is the one that counts.
+#
+# Texts the local lexicon is confident about (sentiment_lexicon.py) are labelled without going to the model at all;
+# --local-threshold tunes how confident it has to be.
+#
+# --engine embedding swaps the chat model for embedding_sentiment.py: records are embedded a few thousand at a time
+# and classified locally, which is far cheaper and faster per record than packed chat completions.
+
+import argparse
+import asyncio
+import csv
+import json
+from pathlib import Path
+
+import client_factory
+import embedding_sentiment
+import sentiment_lexicon
+import token_splitter
+
+INSTRUCTIONS = "Classify the sentiment of each numbered text below. Respond with a JSON object of the form " \
+               '{"results": [{"item": <number>, "label": "Positive" | "Negative" | "Neutral", "score": <1-10>}]}, ' \
+               "one entry per text, where score ranks it on a scale of 1 - 10 where 1 is heavily negative and 10 " \
+               "is heavily positive."
+
+# Completion tokens set aside per item for its {"item": n, "label": ..., "score": n} entry. About 20 when compact,
+# but JSON mode often indents and breaks lines, so leave room for that; a pack cut off anyway is split and retried.
+COMPLETION_TOKENS_PER_ITEM = 30
+# Completion tokens for the {"results": [...]} wrapper around the entries
+COMPLETION_TOKENS_PER_PACK = 20
+# Records tokenized together, so counting uses count_tokens_batch instead of one call per record
+COUNT_WINDOW = 1000
+
+
+# (id, text) pairs from a CSV or JSONL file. Rows without an id field are numbered from 1 in file order.
+def iter_records(path, text_field="text", id_field=None):
+    path = Path(path)
+    with open(path, newline="" if path.suffix.lower() == ".csv" else None, encoding="utf-8") as f:
+        if path.suffix.lower() == ".csv":
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for number, row in enumerate(rows, 1):
+            record_id = row[id_field] if id_field else number
+            yield str(record_id), row[text_field] or ""
+
+
+# Ids already labelled in an earlier run's output file
+def load_checkpoint(output_path):
+    done = set()
+    if not Path(output_path).exists():
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # The last line can be cut short if the previous run was killed mid-write
+                continue
+            if result.get("label"):
+                done.add(result["id"])
+    return done
+
+
+# Most items whose answers fit in one of the model's completions, or None if its limits aren't known
+def max_pack_items(model):
+    try:
+        max_output_tokens = token_splitter.get_model_limits(model)["max_output_tokens"]
+    except KeyError:
+        return None
+    return max(1, (max_output_tokens - COMPLETION_TOKENS_PER_PACK) // COMPLETION_TOKENS_PER_ITEM)
+
+
+# Group (id, text) pairs into packs that fit in pack_tokens prompt tokens and max_items items (fewer if the
+# model's completion can't hold that many answers).
+# A text too long to share a pack is cut down to pack_tokens and sent on its own.
+def iter_packs(records, model, pack_tokens=2000, max_items=50):
+    max_items = min(max_items, max_pack_items(model) or max_items)
+    encoding = token_splitter.get_encoding(model)
+    # Each item goes in as "<number>. <text>\n", which costs about three tokens on top of the text
+    overhead = 3
+    pack = []
+
+    window = []
+    for record in records:
+        window.append(record)
+        if len(window) == COUNT_WINDOW:
+            yield from _pack_window(window, model, encoding, pack, pack_tokens, max_items, overhead)
+            window = []
+    if window:
+        yield from _pack_window(window, model, encoding, pack, pack_tokens, max_items, overhead)
+    if pack:
+        yield [(record_id, text) for record_id, text, _ in pack]
+
+
+# Pack one window of records. `pack` carries the unfinished pack from one window to the next.
+def _pack_window(window, model, encoding, pack, pack_tokens, max_items, overhead):
+    sizes = token_splitter.count_tokens_batch(model, [text for _, text in window])
+    pack_size = sum(size for _, _, size in pack)
+    for (record_id, text), size in zip(window, sizes):
+        size += overhead
+        if size > pack_tokens:
+            text = encoding.decode(encoding.encode(text)[:pack_tokens - overhead])
+            size = pack_tokens
+        if pack and (pack_size + size > pack_tokens or len(pack) == max_items):
+            yield [(item_id, item_text) for item_id, item_text, _ in pack]
+            pack.clear()
+            pack_size = 0
+        pack.append((record_id, text, size))
+        pack_size += size
+
+
+def _pack_message(pack):
+    # Items are numbered within the pack rather than sent with their ids, which could be long or look like text
+    return "".join(f"{number}. {' '.join(text.split())}\n" for number, (_, text) in enumerate(pack, 1))
+
+
+# Classify one pack, returning a result dict per record. A reply cut off at its token limit is thrown away and the
+# pack is split in half and tried again, rather than failing every record in it. A pack with more items than the
+# model's completion can answer is split before it's sent.
+async def classify_pack(pack, model):
+    async def split():
+        half = len(pack) // 2
+        first, second = await asyncio.gather(classify_pack(pack[:half], model), classify_pack(pack[half:], model))
+        return first + second
+
+    if len(pack) > (max_pack_items(model) or len(pack)):
+        return await split()
+    try:
+        # The client is called directly rather than through async_api.chat, for the finish reason
+        async with client_factory.get_request_semaphore():
+            response = await client_factory.get_async_client().chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": INSTRUCTIONS},
+                    {"role": "user", "content": _pack_message(pack)}
+                ],
+                max_tokens=COMPLETION_TOKENS_PER_ITEM * len(pack) + COMPLETION_TOKENS_PER_PACK,
+                response_format={"type": "json_object"}
+            )
+        choice = response.choices[0]
+        if choice.finish_reason == "length" and len(pack) > 1:
+            return await split()
+        answers = {int(answer["item"]): answer for answer in json.loads(choice.message.content)["results"]}
+    except Exception as error:
+        return [{"id": record_id, "error": f"{type(error).__name__}: {error}"} for record_id, _ in pack]
+
+    results = []
+    for number, (record_id, _) in enumerate(pack, 1):
+        answer = answers.get(number)
+        if answer is None or answer.get("label") not in ("Positive", "Negative", "Neutral"):
+            results.append({"id": record_id, "error": "missing from the model's answer"})
+        else:
+            results.append({"id": record_id, "label": answer["label"], "score": answer.get("score")})
+    return results
+
+
+# Classify a window of records with the embedding classifier, returning a result dict per record
+def _classify_embedded(window, classifier):
+    try:
+        answers = classifier.classify([text for _, text in window])
+    except Exception as error:
+        return [{"id": record_id, "error": f"{type(error).__name__}: {error}"} for record_id, _ in window]
+    return [{"id": record_id, "label": answer["label"], "score": answer["score"], "source": "embedding"}
+            for (record_id, _), answer in zip(window, answers)]
+
+
+# Classify every record not already in the output file, keeping up to `concurrency` packs in flight.
+# Records the lexicon scorer is confident about are written straight away and never sent to the model.
+# With engine="embedding" the rest go to embedding_sentiment's classifier instead of the chat model.
+async def classify_file(input_path, output_path, text_field="text", id_field=None, model="gpt-4-1106-preview",
+                        pack_tokens=2000, max_items=50, concurrency=16, scorer=sentiment_lexicon.scorer,
+                        engine="chat"):
+    done = load_checkpoint(output_path)
+    records = ((record_id, text) for record_id, text in iter_records(input_path, text_field, id_field)
+               if record_id not in done)
+    if done:
+        print(f"Resuming: {len(done)} records already classified")
+
+    counts = {"classified": 0, "failed": 0, "local": 0}
+    pending = set()
+    with open(output_path, "a", encoding="utf-8") as out:
+        def write(results):
+            for result in results:
+                out.write(json.dumps(result) + "\n")
+                counts["failed" if "error" in result else "classified"] += 1
+            # Flushed per pack, so whatever is on disk is a valid checkpoint
+            out.flush()
+
+        def deferred(records):
+            for record_id, text in records:
+                local = scorer.classify(text) if scorer is not None else None
+                if local is None:
+                    yield record_id, text
+                else:
+                    out.write(json.dumps({"id": record_id, "label": local["label"], "score": local["score"],
+                                          "source": "lexicon"}) + "\n")
+                    counts["classified"] += 1
+                    counts["local"] += 1
+
+        if engine == "embedding":
+            classifier = embedding_sentiment.get_classifier()
+            window = []
+            for record in deferred(records):
+                window.append(record)
+                if len(window) == embedding_sentiment.BATCH_SIZE:
+                    write(await asyncio.to_thread(_classify_embedded, window, classifier))
+                    window = []
+            if window:
+                write(await asyncio.to_thread(_classify_embedded, window, classifier))
+            return counts
+
+        for pack in iter_packs(deferred(records), model, pack_tokens, max_items):
+            if len(pending) >= concurrency:
+                finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    write(task.result())
+            pending.add(asyncio.ensure_future(classify_pack(pack, model)))
+        for task in asyncio.as_completed(pending):
+            write(await task)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Classify the sentiment of every record in a CSV or JSONL file")
+    parser.add_argument("input", help="CSV or JSONL file to classify")
+    parser.add_argument("-o", "--output", help="JSONL file to append results to (default: <input>.sentiment.jsonl)")
+    parser.add_argument("--text-field", default="text", help="column or key holding the text")
+    parser.add_argument("--id-field", help="column or key holding a unique id (default: row number)")
+    parser.add_argument("--engine", choices=["chat", "embedding"], default="chat",
+                        help="classify with packed chat completions or with the embedding classifier")
+    parser.add_argument("--model", default="gpt-4-1106-preview", help="chat model for the chat engine")
+    parser.add_argument("--pack-tokens", type=int, default=2000, help="most prompt tokens of text per request")
+    parser.add_argument("--max-items", type=int, default=50, help="most texts per request")
+    parser.add_argument("--concurrency", type=int, default=16, help="most requests in flight at once")
+    parser.add_argument("--local-threshold", type=float, default=sentiment_lexicon.DEFAULT_THRESHOLD,
+                        help="lowest lexicon confidence (0 - 1) labelled locally instead of by the model; "
+                             "above 1 sends everything to the model")
+    args = parser.parse_args(argv)
+
+    output = args.output or str(Path(args.input).with_suffix(".sentiment.jsonl"))
+    counts = asyncio.run(classify_file(args.input, output, args.text_field, args.id_field, args.model,
+                                       args.pack_tokens, args.max_items, args.concurrency,
+                                       sentiment_lexicon.LexiconScorer(args.local_threshold), args.engine))
+    print(f"Classified {counts['classified']} records ({counts['failed']} failed) into {output}, "
+          f"{counts['local']} of them locally without an API call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import asyncio
+import os
+import threading
+import weakref
+from pathlib import Path
+
+import httpx
+from dotenv import load_dotenv
+from openai import AsyncOpenAI, OpenAI
+
+import adaptive_concurrency
+import instrumentation
+import rate_limiter
+import request_coalescing
+
+# HTTP/2 needs the optional h2 package, so only turn it on when it's installed
+try:
+    import h2  # noqa: F401
+    HAS_H2 = True
+except ImportError:
+    HAS_H2 = False
+
+# Get environment variables, relative to this file so it works from any of the project's subdirectories
+path = Path(__file__).resolve().parent / "Environment-Variables" / ".env"
+load_dotenv(dotenv_path=path)
+
+# Connection pool settings, all of which can be overridden from the .env file
+MAX_CONNECTIONS = int(os.getenv("openai_max_connections", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("openai_max_keepalive_connections", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("openai_keepalive_expiry", "60"))
+HTTP2 = os.getenv("openai_http2", "false").lower() in ("1", "true", "yes")
+# Send requests somewhere other than api.openai.com, e.g. the local stand-in in fake_server.py
+BASE_URL = os.getenv("openai_base_url") or None
+
+# Share one upstream request between identical chat completions that are in flight at the same time
+COALESCE_REQUESTS = os.getenv("openai_coalesce_requests", "true").lower() in ("1", "true", "yes")
+
+# Append a JSONL record of every API call to this file
+instrumentation.recorder.trace_path = os.getenv("openai_trace_path") or None
+# Most requests the async clients will have in flight at once, across every coroutine in the process
+MAX_IN_FLIGHT = int(os.getenv("openai_max_in_flight", "16"))
+# With adaptive concurrency on, MAX_IN_FLIGHT is only the starting point: the limit then moves between
+# MIN_IN_FLIGHT and MAX_IN_FLIGHT_CEILING depending on latency and 429s (see adaptive_concurrency.py)
+ADAPTIVE_CONCURRENCY = os.getenv("openai_adaptive_concurrency", "true").lower() in ("1", "true", "yes")
+MIN_IN_FLIGHT = int(os.getenv("openai_min_in_flight", "1"))
+MAX_IN_FLIGHT_CEILING = int(os.getenv("openai_max_in_flight_ceiling", "256"))
+
+# Shared by every event loop's semaphore, so the limit learned on one carries over to the next
+concurrency_controller = adaptive_concurrency.ConcurrencyController(MAX_IN_FLIGHT, MIN_IN_FLIGHT,
+                                                                    MAX_IN_FLIGHT_CEILING)
+# 429s are retried inside the client, so they're picked up from the rate limiter rather than the semaphore,
+# and latency is taken from the instrumentation records, which know how long the API itself took
+rate_limiter.get_limiter().listeners.append(lambda model, seconds: concurrency_controller.on_overload())
+instrumentation.recorder.listeners.append(concurrency_controller.on_record)
+
+# One client per API key for the whole process, so every module shares the same warm connection pool
+_clients = {}
+_clients_lock = threading.Lock()
+
+# Async clients and their connections belong to the event loop that made them, so they're kept per loop.
+# Entries go away on their own once a loop is garbage collected.
+_async_state = weakref.WeakKeyDictionary()
+
+
+# Pool limits and HTTP version shared by the sync and async http clients
+def _pool_settings(max_connections, max_keepalive_connections, keepalive_expiry, http2):
+    http2 = HTTP2 if http2 is None else http2
+    if http2 and not HAS_H2:
+        print("HTTP/2 was requested but the h2 package isn't installed (pip install httpx[http2]), using HTTP/1.1")
+        http2 = False
+
+    limits = httpx.Limits(
+        max_connections=max_connections or MAX_CONNECTIONS,
+        max_keepalive_connections=max_keepalive_connections or MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=keepalive_expiry or KEEPALIVE_EXPIRY,
+    )
+    return {"limits": limits, "http2": http2}
+
+
+# Build the httpx client that holds the keep-alive connection pool
+def make_http_client(max_connections=None, max_keepalive_connections=None, keepalive_expiry=None, http2=None):
+    return httpx.Client(event_hooks=instrumentation.http_event_hooks(),
+                        **_pool_settings(max_connections, max_keepalive_connections, keepalive_expiry, http2))
+
+
+# Same as make_http_client, for asyncio code
+def make_async_http_client(max_connections=None, max_keepalive_connections=None, keepalive_expiry=None,
+                           http2=None):
+    return httpx.AsyncClient(event_hooks=instrumentation.async_http_event_hooks(),
+                             **_pool_settings(max_connections, max_keepalive_connections, keepalive_expiry, http2))
+
+
+# Get the shared OpenAI client for an API key (the one in the .env file by default).
+# The first call builds it; every later call, from any module or thread, gets the same instance back.
+def get_client(api_key=None):
+    api_key = api_key or os.getenv("api_key")
+    client = _clients.get(api_key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(api_key)
+            if client is None:
+                # rate_limiter owns retries (honouring Retry-After), so the SDK's own are turned off
+                client = OpenAI(api_key=api_key, base_url=BASE_URL, http_client=make_http_client(), max_retries=0)
+                rate_limiter.limit_client(client)
+                instrumentation.instrument_client(client)
+                if COALESCE_REQUESTS:
+                    request_coalescing.coalesce_client(client)
+                _clients[api_key] = client
+    return client
+
+
+# Close every shared client and its connections, e.g. at the end of a long-running worker
+def close_clients():
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+# Per-event-loop state: the pooled httpx client, the AsyncOpenAI clients built on it, and the in-flight limit
+def _get_async_state():
+    loop = asyncio.get_running_loop()
+    state = _async_state.get(loop)
+    if state is None:
+        state = {
+            "http_client": make_async_http_client(),
+            "clients": {},
+            "semaphore": adaptive_concurrency.AdaptiveSemaphore(concurrency_controller) if ADAPTIVE_CONCURRENCY
+            else asyncio.Semaphore(MAX_IN_FLIGHT),
+        }
+        _async_state[loop] = state
+    return state
+
+
+# Get the shared AsyncOpenAI client for an API key on the running event loop
+def get_async_client(api_key=None):
+    api_key = api_key or os.getenv("api_key")
+    state = _get_async_state()
+    client = state["clients"].get(api_key)
+    if client is None:
+        client = AsyncOpenAI(api_key=api_key, base_url=BASE_URL, http_client=state["http_client"], max_retries=0)
+        rate_limiter.limit_client(client, is_async=True)
+        instrumentation.instrument_client(client, is_async=True)
+        if COALESCE_REQUESTS:
+            request_coalescing.coalesce_client(client, is_async=True)
+        state["clients"][api_key] = client
+    return client
+
+
+# The pooled httpx client behind the async clients, for downloads that should reuse the same connections
+def get_async_http_client():
+    return _get_async_state()["http_client"]
+
+
+# The semaphore that caps how many requests are in flight on the running event loop (an AdaptiveSemaphore unless
+# adaptive concurrency is turned off)
+def get_request_semaphore():
+    return _get_async_state()["semaphore"]
+
+
+# Close the running loop's async clients and their connections
+async def close_async_clients():
+    loop = asyncio.get_running_loop()
+    state = _async_state.pop(loop, None)
+    if state is not None:
+        await state["http_client"].aclose()
@@ -0,0 +1,393 @@
+# Embedding-based sentiment engine: texts are embedded in large batches, the embeddings cached on disk by content
+# hash, and classified locally with matrix math against a model fitted on labelled examples. One embeddings call
+# covers thousands of texts and costs a fraction of a chat completion each, and a text only ever gets embedded once.
+#
+#   classifier = embedding_sentiment.get_classifier()
+#   results = classifier.classify(["Loved it", "Broke after a day"])   # [{"label": ..., "score": ..., ...}, ...]
+#
+# The classifier is either per-label centroids (cosine similarity to each label's mean embedding) or a small
+# ridge-regression linear head, fitted from SEED_EXAMPLES or from any labelled file, e.g. the output of a
+# bulk_sentiment.py run paired with its input:
+#
+#   python embedding_sentiment.py fit reviews.csv --labels reviews.sentiment.jsonl --text-field review --id-field id
+#
+# NumPy makes classification a couple of matrix products; without it the same maths runs in plain Python, which is
+# fine for a handful of texts. The linear head needs NumPy.
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from pathlib import Path
+
+import client_factory
+import token_splitter
+
+# NumPy is optional; without it classification falls back to plain Python
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+CACHE_DIR = Path(__file__).resolve().parent / "cache"
+DEFAULT_STORE_PATH = Path(os.getenv("openai_embedding_cache", CACHE_DIR / "embeddings.sqlite3"))
+DEFAULT_CLASSIFIER_PATH = CACHE_DIR / "sentiment_classifier.json"
+
+EMBEDDING_MODEL = os.getenv("sentiment_embedding_model", "text-embedding-3-small")
+# The embeddings endpoint takes up to 2048 inputs per request, each up to 8191 tokens, and 300k tokens in total
+BATCH_SIZE = 2048
+MAX_INPUT_TOKENS = 8191
+MAX_REQUEST_TOKENS = 300000
+
+LABELS = ("Negative", "Neutral", "Positive")
+
+# A few examples per label, enough for usable centroids until the classifier is fitted on real labelled data
+SEED_EXAMPLES = {
+    "Positive": [
+        "I love this, it works perfectly.",
+        "Absolutely fantastic, would recommend to anyone.",
+        "Great quality and fast delivery, very happy with it.",
+        "Best purchase I've made all year.",
+        "Exceeded my expectations, excellent value.",
+    ],
+    "Negative": [
+        "Terrible, it broke after two days.",
+        "Complete waste of money, do not buy.",
+        "Awful customer service and the product doesn't work.",
+        "Very disappointed, it's cheap junk.",
+        "Worst experience I've had, I want a refund.",
+    ],
+    "Neutral": [
+        "It arrived on Tuesday.",
+        "The box contains the device and a cable.",
+        "It does what the description says.",
+        "I bought it for my office.",
+        "It's okay, nothing special either way.",
+    ],
+}
+
+
+def content_key(model, text):
+    return hashlib.sha256(f"{model}\n{text}".encode("utf-8")).hexdigest()
+
+
+# Embeddings kept in a SQLite file, keyed by a hash of the model and text, as float32 blobs
+class EmbeddingStore:
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        """
+        Args:
+            path: SQLite file to keep the embeddings in (created if missing)
+        """
+        self.path = Path(path)
+        self.hits = 0
+        self.misses = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, "
+                         "created REAL NOT NULL)")
+
+    # {key: vector} for the keys that are stored
+    def get_many(self, keys):
+        found = {}
+        with self._lock:
+            # SQLite caps the number of parameters per statement, so look them up in slices
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = _from_blob(blob)
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, items):
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany("INSERT OR REPLACE INTO embeddings (key, vector, created) VALUES (?, ?, ?)",
+                                 [(key, _to_blob(vector), now) for key, vector in items])
+            self._db.execute("COMMIT")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _to_blob(vector):
+    if HAS_NUMPY:
+        return np.asarray(vector, dtype=np.float32).tobytes()
+    return array("f", vector).tobytes()
+
+
+def _from_blob(blob):
+    if HAS_NUMPY:
+        return np.frombuffer(blob, dtype=np.float32)
+    vector = array("f")
+    vector.frombytes(blob)
+    return list(vector)
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_store():
+    global _default_store
+    if _default_store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                _default_store = EmbeddingStore()
+    return _default_store
+
+
+# Embed one batch of (key, text) pairs, storing the embeddings and adding them to `vectors`
+def _embed_batch(batch, model, client, store, vectors):
+    # The endpoint rejects empty strings, and an empty text carries no sentiment anyway
+    response = client.embeddings.create(model=model, input=[text or " " for _, text in batch])
+    # Each embedding says which input it belongs to; don't rely on them coming back in order
+    data = sorted(response.data, key=lambda item: item.index)
+    embedded = [(key, item.embedding) for (key, _), item in zip(batch, data)]
+    store.set_many(embedded)
+    vectors.update((key, _from_blob(_to_blob(vector))) for key, vector in embedded)
+
+
+# Embeddings for `texts`, in order, from the store where possible and from the API otherwise, in batches of at most
+# `batch_size` texts and `max_request_tokens` tokens. A text longer than the model takes is embedded from its first
+# MAX_INPUT_TOKENS tokens (but stored under the full text). Repeated texts are only looked up and embedded once.
+# Returns a float32 matrix with NumPy, else a list of lists.
+def embed_texts(texts, model=EMBEDDING_MODEL, batch_size=BATCH_SIZE, client=None, store=None,
+                max_request_tokens=MAX_REQUEST_TOKENS):
+    store = store or get_store()
+    keys = [content_key(model, text) for text in texts]
+    unique = dict(zip(keys, texts))
+    vectors = store.get_many(list(unique))
+
+    missing = [(key, text) for key, text in unique.items() if key not in vectors]
+    if missing:
+        client = client or client_factory.get_client()
+        encoding = token_splitter.get_encoding(model)
+        sizes = token_splitter.count_tokens_batch(model, [text for _, text in missing])
+        batch, batch_tokens = [], 0
+        for (key, text), size in zip(missing, sizes):
+            if size > MAX_INPUT_TOKENS:
+                text = encoding.decode(encoding.encode_ordinary(text)[:MAX_INPUT_TOKENS])
+                size = MAX_INPUT_TOKENS
+            if batch and (len(batch) == batch_size or batch_tokens + size > max_request_tokens):
+                _embed_batch(batch, model, client, store, vectors)
+                batch, batch_tokens = [], 0
+            batch.append((key, text))
+            batch_tokens += size
+        if batch:
+            _embed_batch(batch, model, client, store, vectors)
+
+    if HAS_NUMPY:
+        return np.vstack([vectors[key] for key in keys]) if keys else np.zeros((0, 0), dtype=np.float32)
+    return [vectors[key] for key in keys]
+
+
+def _normalize_rows(matrix):
+    if HAS_NUMPY:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
+    result = []
+    for row in matrix:
+        norm = math.sqrt(sum(value * value for value in row)) or 1.0
+        result.append([value / norm for value in row])
+    return result
+
+
+def _softmax(row, temperature):
+    top = max(row)
+    weights = [math.exp((value - top) / temperature) for value in row]
+    total = sum(weights)
+    return [weight / total for weight in weights]
+
+
+class SentimentClassifier:
+    def __init__(self, kind, weights, bias=None, model=EMBEDDING_MODEL, temperature=0.05):
+        """
+        Args:
+            kind: "centroid" (weights are one unit-length mean embedding per label) or "linear" (weights and bias
+                  of a linear head, one column per label)
+            weights: Matrix with one row per embedding dimension for linear, one row per label for centroid
+            bias: Per-label bias of the linear head
+            model: Embedding model the weights were fitted on
+            temperature: Softmax temperature turning centroid similarities into probabilities
+        """
+        self.kind = kind
+        self.weights = np.asarray(weights, dtype=np.float32) if HAS_NUMPY else weights
+        self.bias = None if bias is None else (np.asarray(bias, dtype=np.float32) if HAS_NUMPY else bias)
+        self.model = model
+        self.temperature = temperature
+        if kind == "linear" and not HAS_NUMPY:
+            raise RuntimeError("The linear head needs NumPy (pip install numpy)")
+
+    # Label probabilities per row of `embeddings`, in LABELS order
+    def predict_proba(self, embeddings):
+        if self.kind == "linear":
+            scores = np.asarray(embeddings, dtype=np.float32) @ self.weights + self.bias
+            # Ridge regression onto one-hot labels gives rough scores, not probabilities; clip and rescale them
+            scores = np.clip(scores, 0, None) + 1e-6
+            return scores / scores.sum(axis=1, keepdims=True)
+
+        rows = _normalize_rows(embeddings)
+        if HAS_NUMPY:
+            similarities = rows @ self.weights.T
+            scaled = (similarities - similarities.max(axis=1, keepdims=True)) / self.temperature
+            weights = np.exp(scaled)
+            return weights / weights.sum(axis=1, keepdims=True)
+        return [_softmax([sum(a * b for a, b in zip(row, centroid)) for centroid in self.weights], self.temperature)
+                for row in rows]
+
+    # One {"label", "score" (1 - 10), "confidence"} per text, embedding whatever isn't in the store yet
+    def classify(self, texts, client=None, store=None):
+        if not texts:
+            return []
+        probabilities = self.predict_proba(embed_texts(texts, self.model, client=client, store=store))
+        negative, positive = LABELS.index("Negative"), LABELS.index("Positive")
+        results = []
+        for row in probabilities:
+            row = [float(value) for value in row]
+            best = max(range(len(LABELS)), key=row.__getitem__)
+            # Positive minus negative probability puts the text on the same 1 - 10 scale as the chat prompt
+            polarity = row[positive] - row[negative]
+            results.append({
+                "label": LABELS[best],
+                "score": min(max(round(5.5 + 4.5 * polarity), 1), 10),
+                "confidence": row[best],
+            })
+        return results
+
+    def save(self, path=DEFAULT_CLASSIFIER_PATH):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "kind": self.kind,
+                "model": self.model,
+                "temperature": self.temperature,
+                "weights": [[float(value) for value in row] for row in self.weights],
+                "bias": None if self.bias is None else [float(value) for value in self.bias],
+            }, f)
+
+    @classmethod
+    def load(cls, path=DEFAULT_CLASSIFIER_PATH):
+        with open(path, encoding="utf-8") as f:
+            saved = json.load(f)
+        return cls(saved["kind"], saved["weights"], saved["bias"], saved["model"], saved["temperature"])
+
+
+# Fit a classifier on (text, label) pairs. kind="centroid" averages each label's unit-length embeddings;
+# kind="linear" solves ridge regression from embeddings to one-hot labels (NumPy only).
+def fit(examples, kind="centroid", model=EMBEDDING_MODEL, ridge=1.0, client=None, store=None):
+    examples = [(text, label) for text, label in examples if label in LABELS]
+    labels = [label for _, label in examples]
+    missing = [label for label in LABELS if label not in labels]
+    if missing:
+        raise ValueError(f"No examples for {', '.join(missing)}")
+    embeddings = embed_texts([text for text, _ in examples], model, client=client, store=store)
+
+    if kind == "linear":
+        if not HAS_NUMPY:
+            raise RuntimeError("The linear head needs NumPy (pip install numpy)")
+        targets = np.zeros((len(labels), len(LABELS)), dtype=np.float32)
+        targets[np.arange(len(labels)), [LABELS.index(label) for label in labels]] = 1
+        mean = embeddings.mean(axis=0)
+        centered = embeddings - mean
+        weights = np.linalg.solve(centered.T @ centered + ridge * np.eye(centered.shape[1], dtype=np.float32),
+                                  centered.T @ (targets - targets.mean(axis=0)))
+        bias = targets.mean(axis=0) - mean @ weights
+        return SentimentClassifier("linear", weights, bias, model)
+
+    rows = _normalize_rows(embeddings)
+    centroids = []
+    for label in LABELS:
+        members = [row for row, row_label in zip(rows, labels) if row_label == label]
+        if HAS_NUMPY:
+            centroids.append(np.mean(members, axis=0))
+        else:
+            centroids.append([sum(column) / len(members) for column in zip(*members)])
+    return SentimentClassifier("centroid", _normalize_rows(np.vstack(centroids) if HAS_NUMPY else centroids),
+                               model=model)
+
+
+def seed_examples():
+    return [(text, label) for label, texts in SEED_EXAMPLES.items() for text in texts]
+
+
+_default_classifier = None
+_default_classifier_lock = threading.Lock()
+
+
+# The fitted classifier saved at DEFAULT_CLASSIFIER_PATH, or centroids of SEED_EXAMPLES if nothing has been fitted
+def get_classifier():
+    global _default_classifier
+    if _default_classifier is None:
+        with _default_classifier_lock:
+            if _default_classifier is None:
+                if DEFAULT_CLASSIFIER_PATH.exists():
+                    _default_classifier = SentimentClassifier.load()
+                else:
+                    _default_classifier = fit(seed_examples())
+    return _default_classifier
+
+
+# (text, label) pairs from a CSV or JSONL file of texts and a JSONL file of {"id", "label"} results for it
+def load_labelled(input_path, labels_path, text_field="text", id_field=None):
+    import bulk_sentiment
+
+    labels = {}
+    with open(labels_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if result.get("label"):
+                labels[result["id"]] = result["label"]
+    return [(text, labels[record_id]) for record_id, text in
+            bulk_sentiment.iter_records(input_path, text_field, id_field) if record_id in labels]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fit or try out the embedding-based sentiment classifier")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    fit_parser = subparsers.add_parser("fit", help="fit the classifier on labelled texts and save it")
+    fit_parser.add_argument("input", nargs="?", help="CSV or JSONL file of texts (default: the built-in examples)")
+    fit_parser.add_argument("--labels", help="JSONL file of {\"id\", \"label\"} results for the input")
+    fit_parser.add_argument("--text-field", default="text")
+    fit_parser.add_argument("--id-field")
+    fit_parser.add_argument("--kind", choices=["centroid", "linear"], default="centroid")
+    classify_parser = subparsers.add_parser("classify", help="classify texts given on the command line")
+    classify_parser.add_argument("texts", nargs="+")
+    args = parser.parse_args(argv)
+
+    if args.command == "fit":
+        if args.input and not args.labels:
+            parser.error("fitting on a file needs --labels")
+        if args.input:
+            examples = load_labelled(args.input, args.labels, args.text_field, args.id_field)
+        else:
+            examples = seed_examples()
+        classifier = fit(examples, args.kind)
+        classifier.save()
+        print(f"Fitted a {args.kind} classifier on {len(examples)} examples, saved to {DEFAULT_CLASSIFIER_PATH}")
+    else:
+        for text, result in zip(args.texts, get_classifier().classify(args.texts)):
+            print(f"{result['label']}, {result['score']} ({result['confidence']:.2f}): {text}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,532 @@
+# Local stand-in for the OpenAI and WolframAlpha endpoints the project talks to, for benchmarking offline.
+# Responses are canned but schema-correct, so the real SDK clients parse them like the real thing.
+# Latency, server errors and 429s can all be injected to see how the project behaves under pressure.
+#
+#   python fake_server.py --port 8787 --latency-ms 200 --latency-dist lognormal --rate-limit-rate 0.05
+#
+# Then point the project at it from the .env file:
+#   openai_base_url=http://127.0.0.1:8787/v1
+#   wlf_base_url=http://127.0.0.1:8787/v2/query
+#   api_key=anything
+
+import argparse
+import base64
+import email.parser
+import email.policy
+import json
+import math
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+DEFAULT_REPLY = "This is a canned response from the local stand-in server."
+
+
+# 1x1 PNG served for generated images and variations
+def _tiny_png():
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(b"\x00\xff\xff\xff")) + chunk(b"IEND", b""))
+
+
+TINY_PNG = _tiny_png()
+
+
+class LatencyModel:
+    def __init__(self, distribution="fixed", mean_ms=0.0, spread_ms=0.0):
+        """
+        Args:
+            distribution: fixed, uniform, normal, lognormal or exponential
+            mean_ms: Average added latency per response, in milliseconds
+            spread_ms: Half-width for uniform, standard deviation for normal and lognormal
+        """
+        if distribution not in ("fixed", "uniform", "normal", "lognormal", "exponential"):
+            raise ValueError(f"Unknown latency distribution {distribution!r}")
+        self.distribution = distribution
+        self.mean_ms = mean_ms
+        self.spread_ms = spread_ms
+
+    # Draw one latency, in seconds
+    def sample(self):
+        if self.mean_ms <= 0:
+            return 0.0
+        if self.distribution == "uniform":
+            ms = random.uniform(self.mean_ms - self.spread_ms, self.mean_ms + self.spread_ms)
+        elif self.distribution == "normal":
+            ms = random.gauss(self.mean_ms, self.spread_ms)
+        elif self.distribution == "lognormal":
+            # Pick mu and sigma so the distribution has the requested mean and standard deviation,
+            # which gives the long right tail real APIs have
+            sigma = math.sqrt(math.log(1 + (self.spread_ms / self.mean_ms) ** 2))
+            ms = random.lognormvariate(math.log(self.mean_ms) - sigma ** 2 / 2, sigma)
+        elif self.distribution == "exponential":
+            ms = random.expovariate(1 / self.mean_ms)
+        else:
+            ms = self.mean_ms
+        return max(ms, 0.0) / 1000
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # socketserver's default backlog of 5 overflows under a burst of connections, adding tail latency and
+    # connection errors that would be blamed on the API
+    request_queue_size = 1024
+
+    def __init__(self, address, latency=None, error_rate=0.0, rate_limit_rate=0.0, retry_after=1.0,
+                 token_delay_ms=0.0, reply=DEFAULT_REPLY, equation_result="42", batch_delay=1.0):
+        """
+        Args:
+            address: (host, port) to listen on, port 0 picks a free one
+            latency: LatencyModel applied before every response (or before the first chunk when streaming)
+            error_rate: Fraction of API requests answered with a 500
+            rate_limit_rate: Fraction of API requests answered with a 429 and a Retry-After header
+            retry_after: Seconds sent in the Retry-After header of injected 429s
+            token_delay_ms: Pause between streamed chunks
+            reply: Text returned by chat completions, transcriptions and translations
+            equation_result: Plaintext result returned for WolframAlpha queries
+            batch_delay: Seconds after creation a batch is reported as completed
+        """
+        super().__init__(address, FakeRequestHandler)
+        self.latency = latency or LatencyModel()
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.token_delay_ms = token_delay_ms
+        self.reply = reply
+        self.equation_result = equation_result
+        self.batch_delay = batch_delay
+        # Uploaded files and created batches, by id
+        self.files = {}
+        self.batches = {}
+        self.counts = {"requests": 0, "errors": 0, "rate_limited": 0}
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def next_id(self):
+        with self._lock:
+            self._next_id += 1
+            return self._next_id
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+
+class FakeRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeOpenAI/1.0"
+
+    def log_message(self, format, *args):
+        # Benchmarks send thousands of requests, so stay quiet
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message, error_type, code=None, headers=None):
+        self._send(status, {"error": {"message": message, "type": error_type, "param": None, "code": code}},
+                   headers=headers)
+
+    # Decide whether this request gets an injected failure; returns True if one was sent
+    def _inject_failure(self):
+        roll = random.random()
+        if roll < self.server.rate_limit_rate:
+            self.server.count("rate_limited")
+            time.sleep(self.server.latency.sample())
+            self._send_error(429, "Rate limit reached (injected by the local stand-in server)", "requests",
+                             "rate_limit_exceeded",
+                             headers={"Retry-After": f"{self.server.retry_after:g}",
+                                      "x-ratelimit-remaining-requests": "0",
+                                      "x-ratelimit-reset-requests": f"{self.server.retry_after:g}s"})
+            return True
+        if roll < self.server.rate_limit_rate + self.server.error_rate:
+            self.server.count("errors")
+            time.sleep(self.server.latency.sample())
+            self._send_error(500, "The server had an error (injected by the local stand-in server)", "server_error")
+            return True
+        return False
+
+    def _file_url(self, name):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/files/{name}"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        file_match = re.fullmatch(r"/v1/files/([^/]+)/content", url.path)
+        batch_match = re.fullmatch(r"/v1/batches/([^/]+)", url.path)
+        if url.path == "/files/image.png":
+            self._send(200, TINY_PNG, "image/png")
+        elif url.path == "/v2/query":
+            self.server.count("requests")
+            if not self._inject_failure():
+                time.sleep(self.server.latency.sample())
+                self._wolfram(parse_qs(url.query))
+        elif file_match:
+            self._file_content(file_match.group(1))
+        elif batch_match:
+            self._get_batch(batch_match.group(1))
+        else:
+            self._send_error(404, f"Unknown path {url.path}", "invalid_request_error")
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        body = self._read_body()
+        routes = {
+            "/v1/chat/completions": self._chat_completions,
+            "/v1/images/generations": self._images,
+            "/v1/images/variations": self._images,
+            "/v1/audio/transcriptions": self._audio,
+            "/v1/audio/translations": self._audio,
+            "/v1/embeddings": self._embeddings,
+            "/v1/files": self._upload_file,
+            "/v1/batches": self._create_batch,
+        }
+        cancel_match = re.fullmatch(r"/v1/batches/([^/]+)/cancel", path)
+        if cancel_match:
+            self._cancel_batch(cancel_match.group(1))
+            return
+        handler = routes.get(path)
+        if handler is None:
+            self._send_error(404, f"Unknown path {path}", "invalid_request_error")
+            return
+
+        self.server.count("requests")
+        if self._inject_failure():
+            return
+        handler(body)
+
+    # The non-streaming chat completion for a request, also used for the lines of a batch
+    def _completion_body(self, request):
+        prompt_tokens = sum(len(str(message.get("content", "")).split()) + 3
+                            for message in request.get("messages", [])) + 3
+        words = self.server.reply.split(" ")
+        max_tokens = request.get("max_tokens") or request.get("max_completion_tokens")
+        if max_tokens:
+            words = words[:max_tokens]
+        if (request.get("response_format") or {}).get("type") == "json_object":
+            words = [self._json_reply(request)]
+        return {
+            "id": f"chatcmpl-fake-{self.server.next_id()}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "gpt-3.5-turbo"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": " ".join(words)},
+                "finish_reason": "stop",
+                "logprobs": None,
+            }],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(words),
+                      "total_tokens": prompt_tokens + len(words)},
+        }
+
+    # JSON mode answer: a neutral result for every numbered line of the last message, which is how packed requests
+    # (bulk_sentiment.py) list their items, or a single canned bullet point for fused summaries (Summarizer/fused.py)
+    def _json_reply(self, request):
+        messages = request.get("messages") or [{}]
+        if '"points"' in str(messages[0].get("content", "")):
+            reply = self.server.reply
+            return json.dumps({"points": [{"point": reply, "clarification": reply, "detail": reply}]})
+        content = str(messages[-1].get("content", ""))
+        items = [int(match) for match in re.findall(r"^(\d+)\. ", content, re.MULTILINE)]
+        return json.dumps({"results": [{"item": item, "label": "Neutral", "score": 5} for item in items]})
+
+    def _chat_completions(self, body):
+        request = json.loads(body or b"{}")
+        completion = self._completion_body(request)
+        completion_id, created, model = completion["id"], completion["created"], completion["model"]
+        usage = completion["usage"]
+        words = completion["choices"][0]["message"]["content"].split(" ")
+
+        time.sleep(self.server.latency.sample())
+        if not request.get("stream"):
+            self._send(200, completion)
+            return
+
+        # Server-sent events over a chunked response, one word per chunk
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(choices, extra=None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": choices}
+            chunk.update(extra or {})
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+
+        for i, word in enumerate(words):
+            delta = {"content": word if i == 0 else " " + word}
+            if i == 0:
+                delta["role"] = "assistant"
+            event([{"index": 0, "delta": delta, "finish_reason": None, "logprobs": None}])
+            if self.server.token_delay_ms:
+                time.sleep(self.server.token_delay_ms / 1000)
+        event([{"index": 0, "delta": {}, "finish_reason": "stop", "logprobs": None}])
+        if (request.get("stream_options") or {}).get("include_usage"):
+            event([], {"usage": usage})
+        self._write_chunk("data: [DONE]\n\n")
+        self._write_chunk("")
+
+    def _write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _images(self, body):
+        # Variations arrive as multipart form data; generations as JSON. Only generations can ask for base64.
+        request = json.loads(body) if self.headers.get("Content-Type", "").startswith("application/json") else {}
+        count = int(request.get("n") or 1)
+        if request.get("response_format") == "b64_json":
+            data = [{"b64_json": base64.b64encode(TINY_PNG).decode("ascii")} for _ in range(count)]
+        else:
+            data = [{"url": self._file_url("image.png")} for _ in range(count)]
+        time.sleep(self.server.latency.sample())
+        self._send(200, {"created": int(time.time()), "data": data})
+
+    def _audio(self, body):
+        time.sleep(self.server.latency.sample())
+        # The SDK asks for JSON unless told otherwise; plain text is what response_format=text gets back
+        if b'name="response_format"\r\n\r\ntext' in body:
+            self._send(200, self.server.reply.encode("utf-8"), "text/plain")
+        else:
+            self._send(200, {"text": self.server.reply})
+
+    # Embeddings are hashed bags of words: deterministic, and texts sharing words point the same way, so nearest-
+    # centroid classification behaves sensibly against them
+    def _embeddings(self, body):
+        request = json.loads(body or b"{}")
+        inputs = request.get("input") or []
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        dimensions = int(request.get("dimensions") or 256)
+        data = []
+        total_tokens = 0
+        for index, text in enumerate(inputs):
+            vector = [0.0] * dimensions
+            words = re.findall(r"[a-z']+", str(text).lower())
+            total_tokens += len(words)
+            for word in words:
+                digest = zlib.crc32(word.encode("utf-8"))
+                vector[digest % dimensions] += 1.0 if digest & 0x80000000 else -1.0
+            norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+            vector = [value / norm for value in vector]
+            if request.get("encoding_format") == "base64":
+                embedding = base64.b64encode(struct.pack(f"<{dimensions}f", *vector)).decode("ascii")
+            else:
+                embedding = vector
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        time.sleep(self.server.latency.sample())
+        self._send(200, {"object": "list", "data": data, "model": request.get("model", "text-embedding-3-small"),
+                         "usage": {"prompt_tokens": total_tokens, "total_tokens": total_tokens}})
+
+    # Multipart form fields as {name: (filename, bytes)}
+    def _form_fields(self, body):
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f"Content-Type: {self.headers.get('Content-Type', '')}\r\n\r\n".encode("latin-1") + body
+        )
+        fields = {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            fields[name] = (part.get_filename(), part.get_payload(decode=True))
+        return fields
+
+    def _store_file(self, filename, data, purpose):
+        file = {"id": f"file-fake-{self.server.next_id()}", "object": "file", "bytes": len(data),
+                "created_at": int(time.time()), "filename": filename, "purpose": purpose, "status": "processed"}
+        with self.server._lock:
+            self.server.files[file["id"]] = (file, data)
+        return file
+
+    def _upload_file(self, body):
+        fields = self._form_fields(body)
+        filename, data = fields.get("file", (None, None))
+        if data is None:
+            self._send_error(400, "Missing file", "invalid_request_error")
+            return
+        purpose = fields.get("purpose", (None, b"batch"))[1].decode("utf-8")
+        self._send(200, self._store_file(filename or "upload.jsonl", data, purpose))
+
+    def _file_content(self, file_id):
+        entry = self.server.files.get(file_id)
+        if entry is None:
+            self._send_error(404, f"No such File object: {file_id}", "invalid_request_error")
+        else:
+            self._send(200, entry[1], "application/octet-stream")
+
+    def _create_batch(self, body):
+        request = json.loads(body or b"{}")
+        if request.get("input_file_id") not in self.server.files:
+            self._send_error(400, f"No such File object: {request.get('input_file_id')}", "invalid_request_error")
+            return
+        now = int(time.time())
+        batch = {
+            "id": f"batch_fake_{self.server.next_id()}",
+            "object": "batch",
+            "endpoint": request.get("endpoint"),
+            "errors": None,
+            "input_file_id": request["input_file_id"],
+            "completion_window": request.get("completion_window", "24h"),
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": now,
+            "in_progress_at": None,
+            "expires_at": now + 24 * 3600,
+            "completed_at": None,
+            "cancelled_at": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "metadata": request.get("metadata"),
+        }
+        with self.server._lock:
+            self.server.batches[batch["id"]] = batch
+        self._send(200, batch)
+
+    # Batches move from validating to in_progress on the first poll and complete batch_delay seconds after
+    # they were created, at which point every line is answered at once
+    def _get_batch(self, batch_id):
+        batch = self.server.batches.get(batch_id)
+        if batch is None:
+            self._send_error(404, f"No such Batch object: {batch_id}", "invalid_request_error")
+            return
+        if batch["status"] == "validating":
+            batch["status"] = "in_progress"
+            batch["in_progress_at"] = int(time.time())
+        elif batch["status"] == "in_progress" and time.time() >= batch["created_at"] + self.server.batch_delay:
+            self._run_batch(batch)
+        self._send(200, batch)
+
+    def _run_batch(self, batch):
+        input_data = self.server.files[batch["input_file_id"]][1]
+        output, errors = [], []
+        for line in input_data.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            result = {"id": f"batch_req_fake_{self.server.next_id()}", "custom_id": request.get("custom_id"),
+                      "error": None}
+            if request.get("url") != "/v1/chat/completions":
+                result["response"] = {"status_code": 400, "request_id": None, "body": {"error": {
+                    "message": f"Unsupported batch url {request.get('url')}", "type": "invalid_request_error"}}}
+                errors.append(result)
+            elif random.random() < self.server.error_rate:
+                result["response"] = {"status_code": 500, "request_id": None, "body": {"error": {
+                    "message": "The server had an error (injected by the local stand-in server)",
+                    "type": "server_error"}}}
+                errors.append(result)
+            else:
+                result["response"] = {"status_code": 200, "request_id": f"req_fake_{self.server.next_id()}",
+                                      "body": self._completion_body(request.get("body") or {})}
+                output.append(result)
+
+        def jsonl(results):
+            return "".join(json.dumps(result) + "\n" for result in results).encode("utf-8")
+        if output:
+            batch["output_file_id"] = self._store_file(f"{batch['id']}_output.jsonl", jsonl(output),
+                                                       "batch_output")["id"]
+        if errors:
+            batch["error_file_id"] = self._store_file(f"{batch['id']}_error.jsonl", jsonl(errors),
+                                                      "batch_output")["id"]
+        batch["request_counts"] = {"total": len(output) + len(errors), "completed": len(output),
+                                   "failed": len(errors)}
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+
+    def _cancel_batch(self, batch_id):
+        batch = self.server.batches.get(batch_id)
+        if batch is None:
+            self._send_error(404, f"No such Batch object: {batch_id}", "invalid_request_error")
+            return
+        if batch["status"] in ("validating", "in_progress"):
+            batch["status"] = "cancelled"
+            batch["cancelled_at"] = int(time.time())
+        self._send(200, batch)
+
+    def _wolfram(self, query):
+        question = (query.get("input") or [""])[0]
+        xml = (
+            "<?xml version='1.0' encoding='UTF-8'?>"
+            "<queryresult success='true' error='false' numpods='2'>"
+            "<pod title='Input' id='Input' numsubpods='1'><subpod title=''>"
+            f"<plaintext>{_xml_escape(question)}</plaintext></subpod></pod>"
+            "<pod title='Result' id='Result' primary='true' numsubpods='1'><subpod title=''>"
+            f"<plaintext>{_xml_escape(self.server.equation_result)}</plaintext></subpod></pod>"
+            "</queryresult>"
+        )
+        self._send(200, xml.encode("utf-8"), "text/xml; charset=utf-8")
+
+
+def _xml_escape(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace("'", "&apos;")
+
+
+# Start a server on a background thread, e.g. from a benchmark script. Call .shutdown() when done.
+def start_server(host="127.0.0.1", port=0, **config):
+    server = FakeServer((host, port), **config)
+    thread = threading.Thread(target=server.serve_forever, name="fake-openai-server", daemon=True)
+    thread.start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI and WolframAlpha APIs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="mean added latency per response")
+    parser.add_argument("--latency-spread-ms", type=float, default=0.0,
+                        help="half-width (uniform) or standard deviation (normal, lognormal) of the latency")
+    parser.add_argument("--latency-dist", default="fixed",
+                        choices=["fixed", "uniform", "normal", "lognormal", "exponential"])
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that get a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests that get a 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--token-delay-ms", type=float, default=0.0, help="pause between streamed chunks")
+    parser.add_argument("--reply", default=DEFAULT_REPLY, help="text returned by chat and audio endpoints")
+    parser.add_argument("--batch-delay", type=float, default=1.0, help="seconds before a batch completes")
+    args = parser.parse_args(argv)
+
+    server = FakeServer(
+        (args.host, args.port),
+        latency=LatencyModel(args.latency_dist, args.latency_ms, args.latency_spread_ms),
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        token_delay_ms=args.token_delay_ms,
+        reply=args.reply,
+        batch_delay=args.batch_delay,
+    )
+    print(f"Serving on {server.base_url} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print("Served", server.counts)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,9 @@
-import os
-from pathlib import Path
-
 import requests
-from dotenv import load_dotenv
-from openai import OpenAI
 
-# Get environment variables
-path = Path("Environment-Variables/.env")
-load_dotenv(dotenv_path=path)
+import client_factory
 
-# Set up openai client
-client = OpenAI(
-    api_key=os.getenv("api_key")
-)
+# Set up openai client (shared with the rest of the project)
+client = client_factory.get_client()
 
 
 def generate_image():
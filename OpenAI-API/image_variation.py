@@ -1,16 +1,9 @@
-import os
-from pathlib import Path
 import requests
-from dotenv import load_dotenv
-from openai import OpenAI
 
-path = Path("Environment-Variables/.env")
-load_dotenv(dotenv_path=path)
+import client_factory
 
-# set up the openai client
-client = OpenAI(
-    api_key=os.getenv("api_key")
-)
+# set up the openai client (shared with the rest of the project)
+client = client_factory.get_client()
 
 
 def create_variation():
@@ -0,0 +1,429 @@
+# Per-call latency and usage tracking for every API call in the project.
+# client_factory wraps each client's endpoints (chat, images, audio, embeddings) and hooks its HTTP pool, so every
+# call records wall time, time to first byte (and to the first token, for streams), retries, token usage and bytes
+# sent and received without any
+# changes at the call site. Calls can be grouped under an entry point:
+#
+#   with instrumentation.entry_point("summarizer.clarify"):
+#       client.chat.completions.create(...)
+#
+# Records are kept in memory for percentile summaries, appended to a JSONL trace file when openai_trace_path is
+# set in the .env file, and can be exported as Prometheus text.
+
+import contextlib
+import contextvars
+import functools
+import json
+import math
+import threading
+import time
+from collections import deque
+
+# The call being made on this thread/task, which the HTTP hooks add their numbers to
+_current_call = contextvars.ContextVar("openai_current_call", default=None)
+# The label calls are grouped under in summaries, defaulting to the endpoint name
+_entry_point = contextvars.ContextVar("openai_entry_point", default=None)
+
+# Client attributes to wrap, as (endpoint name, path to the method)
+ENDPOINTS = [
+    ("chat.completions", ("chat", "completions", "create")),
+    ("images.generate", ("images", "generate")),
+    ("images.variation", ("images", "create_variation")),
+    ("audio.transcriptions", ("audio", "transcriptions", "create")),
+    ("audio.translations", ("audio", "translations", "create")),
+    ("embeddings", ("embeddings", "create")),
+]
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _percentile(sorted_values, quantile):
+    if not sorted_values:
+        return None
+    # Nearest-rank percentile
+    return sorted_values[max(math.ceil(quantile * len(sorted_values)) - 1, 0)]
+
+
+class Recorder:
+    def __init__(self, max_records=100000, trace_path=None):
+        """
+        Args:
+            max_records: How many of the most recent calls to keep for summaries
+            trace_path: JSONL file every record is appended to as it's made, or None
+        """
+        self.records = deque(maxlen=max_records)
+        self.trace_path = trace_path
+        # Called as listener(record) after every call, e.g. so the adaptive concurrency limit sees upstream latency
+        self.listeners = []
+        self._lock = threading.Lock()
+        # Running totals survive records falling out of the deque, so counters never go backwards
+        self._totals = {}
+
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+            totals = self._totals.setdefault(record["entry_point"], {
+                "calls": 0, "errors": 0, "partial": 0, "retries": 0, "wall_time": 0.0,
+                "prompt_tokens": 0, "completion_tokens": 0, "bytes_up": 0, "bytes_down": 0,
+            })
+            totals["calls"] += 1
+            totals["errors"] += record["error"] is not None
+            totals["partial"] += record["partial"]
+            for name in ("retries", "wall_time", "prompt_tokens", "completion_tokens", "bytes_up", "bytes_down"):
+                totals[name] += record[name] or 0
+            if self.trace_path:
+                with open(self.trace_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record) + "\n")
+        for listener in self.listeners:
+            listener(record)
+
+    # p50/p95/p99 of wall time, time to first byte and time to first token, plus totals, per entry point
+    def summary(self):
+        with self._lock:
+            records = list(self.records)
+            totals = {name: dict(values) for name, values in self._totals.items()}
+
+        grouped = {}
+        for record in records:
+            grouped.setdefault(record["entry_point"], []).append(record)
+
+        summary = {}
+        for name, entry_totals in totals.items():
+            entry_records = grouped.get(name, [])
+            wall = sorted(record["wall_time"] for record in entry_records)
+            ttfb = sorted(record["ttfb"] for record in entry_records if record["ttfb"] is not None)
+            ttft = sorted(record["ttft"] for record in entry_records if record.get("ttft") is not None)
+            summary[name] = dict(entry_totals)
+            for quantile in QUANTILES:
+                label = f"p{int(quantile * 100)}"
+                summary[name][f"wall_{label}"] = _percentile(wall, quantile)
+                summary[name][f"ttfb_{label}"] = _percentile(ttfb, quantile)
+                summary[name][f"ttft_{label}"] = _percentile(ttft, quantile)
+        return summary
+
+    def export_jsonl(self, path):
+        with self._lock:
+            records = list(self.records)
+        with open(path, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+
+    # The summary in Prometheus text exposition format
+    def prometheus_text(self):
+        lines = []
+        summary = self.summary()
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{_escape_label(val)}"' for key, val in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value:g}")
+
+        for base, field, help_text in (("openai_call_duration_seconds", "wall", "Wall time per API call"),
+                                       ("openai_call_ttfb_seconds", "ttfb", "Time to first byte per API call"),
+                                       ("openai_call_ttft_seconds", "ttft",
+                                        "Time to first token per streamed API call")):
+            samples = []
+            for name, values in summary.items():
+                for quantile in QUANTILES:
+                    value = values[f"{field}_p{int(quantile * 100)}"]
+                    if value is not None:
+                        samples.append(({"entry_point": name, "quantile": f"{quantile:g}"}, value))
+            metric(base, "summary", help_text, samples)
+            # Sum and count belong to the same family, so they have to follow its quantiles directly
+            if field == "wall":
+                for name, values in summary.items():
+                    label = _escape_label(name)
+                    lines.append(f'{base}_sum{{entry_point="{label}"}} {values["wall_time"]:g}')
+                    lines.append(f'{base}_count{{entry_point="{label}"}} {values["calls"]:g}')
+
+        metric("openai_calls_total", "counter", "API calls made",
+               [({"entry_point": name}, values["calls"]) for name, values in summary.items()])
+        metric("openai_call_errors_total", "counter", "API calls that raised",
+               [({"entry_point": name}, values["errors"]) for name, values in summary.items()])
+        metric("openai_call_partial_total", "counter", "Streamed API calls closed before their last chunk",
+               [({"entry_point": name}, values["partial"]) for name, values in summary.items()])
+        metric("openai_call_retries_total", "counter", "HTTP retries made by the client",
+               [({"entry_point": name}, values["retries"]) for name, values in summary.items()])
+        metric("openai_tokens_total", "counter", "Tokens billed",
+               [({"entry_point": name, "kind": kind}, values[f"{kind}_tokens"])
+                for name, values in summary.items() for kind in ("prompt", "completion")])
+        metric("openai_bytes_total", "counter", "Bytes sent and received",
+               [({"entry_point": name, "direction": direction}, values[f"bytes_{direction}"])
+                for name, values in summary.items() for direction in ("up", "down")])
+        return "\n".join(lines) + "\n"
+
+    def print_summary(self):
+        for name, values in sorted(self.summary().items()):
+            p50, p95, p99 = (values[f"wall_p{q}"] for q in (50, 95, 99))
+            # Only streamed calls have a first token to time
+            ttft = "" if values["ttft_p50"] is None else \
+                f"first token p50/p95 {_ms(values['ttft_p50'])}/{_ms(values['ttft_p95'])} ms, "
+            partial = f"{values['partial']} closed early, " if values["partial"] else ""
+            print(f"{name}: {values['calls']} calls, {values['errors']} errors, {partial}{values['retries']} retries, "
+                  f"wall p50/p95/p99 {_ms(p50)}/{_ms(p95)}/{_ms(p99)} ms, {ttft}"
+                  f"{values['prompt_tokens']} prompt + {values['completion_tokens']} completion tokens")
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _ms(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.0f}"
+
+
+# Shared recorder every instrumented client reports to (client_factory sets its trace_path from the .env file)
+recorder = Recorder()
+
+
+# Group the calls made inside the block under a label
+@contextlib.contextmanager
+def entry_point(name):
+    token = _entry_point.set(name)
+    try:
+        yield
+    finally:
+        _entry_point.reset(token)
+
+
+def _start_call(endpoint, model=None, stream=False):
+    return {
+        "start": time.perf_counter(),
+        "timestamp": time.time(),
+        "endpoint": endpoint,
+        "entry_point": _entry_point.get() or endpoint,
+        "model": model,
+        "stream": stream,
+        "attempts": 0,
+        "attempt_start": None,
+        "ttfb": None,
+        "upstream": None,
+        "ttft": None,
+        "bytes_up": 0,
+        "responses": [],
+        "prompt_tokens": None,
+        "completion_tokens": None,
+        "partial": False,
+    }
+
+
+def _finish_call(call, result=None, error=None):
+    usage = getattr(result, "usage", None)
+    if usage is not None:
+        call["prompt_tokens"] = getattr(usage, "prompt_tokens", None)
+        call["completion_tokens"] = getattr(usage, "completion_tokens", None)
+    recorder.add({
+        "timestamp": call["timestamp"],
+        "entry_point": call["entry_point"],
+        "endpoint": call["endpoint"],
+        "model": call["model"],
+        "stream": call["stream"],
+        "wall_time": time.perf_counter() - call["start"],
+        "ttfb": call["ttfb"],
+        "upstream": call["upstream"],
+        "ttft": call["ttft"],
+        "retries": max(call["attempts"] - 1, 0),
+        "prompt_tokens": call["prompt_tokens"],
+        "completion_tokens": call["completion_tokens"],
+        "bytes_up": call["bytes_up"],
+        "bytes_down": sum(response.num_bytes_downloaded for response in call["responses"]),
+        "error": None if error is None else type(error).__name__,
+        "partial": call["partial"],
+    })
+
+
+# Time a block that doesn't go through an instrumented client (e.g. the WolframAlpha query)
+@contextlib.contextmanager
+def track(endpoint):
+    call = _start_call(endpoint)
+    token = _current_call.set(call)
+    try:
+        yield call
+    except BaseException as error:
+        _finish_call(call, error=error)
+        raise
+    else:
+        _finish_call(call)
+    finally:
+        _current_call.reset(token)
+
+
+# httpx event hooks. Every attempt, retries included, passes through these.
+def _on_request(request):
+    call = _current_call.get()
+    if call is not None:
+        call["attempts"] += 1
+        call["attempt_start"] = time.perf_counter()
+        call["bytes_up"] += int(request.headers.get("content-length") or 0)
+
+
+def _on_response(response):
+    call = _current_call.get()
+    if call is not None:
+        # Headers of the attempt that finally answered; streams overwrite this with their first chunk.
+        # upstream is the same wait counted from when that attempt was sent, leaving out rate limiter sleeps and
+        # earlier attempts, so it's just the API's own time.
+        now = time.perf_counter()
+        call["ttfb"] = now - call["start"]
+        if call["attempt_start"] is not None:
+            call["upstream"] = now - call["attempt_start"]
+        call["responses"].append(response)
+
+
+async def _on_request_async(request):
+    _on_request(request)
+
+
+async def _on_response_async(response):
+    _on_response(response)
+
+
+def http_event_hooks():
+    return {"request": [_on_request], "response": [_on_response]}
+
+
+def async_http_event_hooks():
+    return {"request": [_on_request_async], "response": [_on_response_async]}
+
+
+class _InstrumentedStream:
+    # Passes chunks through, noting when the first one and the first with any text arrive and picking up the usage
+    # chunk, and records the call at the end. A stream closed or dropped before its last chunk (a break out of the
+    # loop, an exception in the caller) is still recorded, marked partial, when it's closed, exited or collected.
+    def __init__(self, stream, call):
+        self._stream = stream
+        self._call = call
+        self._first = True
+        self._recorded = False
+
+    # Record the call once, however the stream ends
+    def _finish(self, error=None, partial=False):
+        if self._recorded:
+            return
+        self._recorded = True
+        self._call["partial"] = partial
+        _finish_call(self._call, error=error)
+
+    def _observe(self, chunk):
+        if self._first:
+            now = time.perf_counter()
+            self._call["ttfb"] = now - self._call["start"]
+            if self._call["attempt_start"] is not None:
+                self._call["upstream"] = now - self._call["attempt_start"]
+            self._first = False
+        if self._call["ttft"] is None and any(getattr(choice.delta, "content", None)
+                                               for choice in getattr(chunk, "choices", None) or []):
+            self._call["ttft"] = time.perf_counter() - self._call["start"]
+        if getattr(chunk, "usage", None) is not None:
+            self._call["prompt_tokens"] = chunk.usage.prompt_tokens
+            self._call["completion_tokens"] = chunk.usage.completion_tokens
+
+    def __iter__(self):
+        try:
+            for chunk in self._stream:
+                self._observe(chunk)
+                yield chunk
+        except GeneratorExit:
+            # The loop over the stream was left early
+            self._finish(partial=True)
+            raise
+        except BaseException as error:
+            self._finish(error=error, partial=True)
+            raise
+        self._finish()
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                self._observe(chunk)
+                yield chunk
+        except GeneratorExit:
+            self._finish(partial=True)
+            raise
+        except BaseException as error:
+            self._finish(error=error, partial=True)
+            raise
+        self._finish()
+
+    def close(self):
+        # Async streams return a coroutine here, which the caller awaits as usual
+        result = self._stream.close()
+        self._finish(partial=True)
+        return result
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, error, traceback):
+        try:
+            return self._stream.__exit__(exc_type, error, traceback)
+        finally:
+            self._finish(error=error, partial=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, error, traceback):
+        try:
+            return await self._stream.__aexit__(exc_type, error, traceback)
+        finally:
+            self._finish(error=error, partial=True)
+
+    def __del__(self):
+        # Dropped without being read to the end or closed
+        if not getattr(self, "_recorded", True):
+            self._finish(partial=True)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def _wrap(endpoint, method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        call = _start_call(endpoint, kwargs.get("model"), bool(kwargs.get("stream")))
+        token = _current_call.set(call)
+        try:
+            result = method(*args, **kwargs)
+        except BaseException as error:
+            _finish_call(call, error=error)
+            raise
+        finally:
+            _current_call.reset(token)
+        if kwargs.get("stream"):
+            return _InstrumentedStream(result, call)
+        _finish_call(call, result)
+        return result
+    return wrapper
+
+
+def _wrap_async(endpoint, method):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        call = _start_call(endpoint, kwargs.get("model"), bool(kwargs.get("stream")))
+        token = _current_call.set(call)
+        try:
+            result = await method(*args, **kwargs)
+        except BaseException as error:
+            _finish_call(call, error=error)
+            raise
+        finally:
+            _current_call.reset(token)
+        if kwargs.get("stream"):
+            return _InstrumentedStream(result, call)
+        _finish_call(call, result)
+        return result
+    return wrapper
+
+
+# Wrap a client's endpoints so every call through it is recorded. Works for OpenAI and AsyncOpenAI.
+def instrument_client(client, is_async=False):
+    for endpoint, path in ENDPOINTS:
+        resource = client
+        for name in path[:-1]:
+            resource = getattr(resource, name)
+        method = getattr(resource, path[-1])
+        setattr(resource, path[-1], (_wrap_async if is_async else _wrap)(endpoint, method))
+    return client
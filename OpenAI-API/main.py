@@ -1,12 +1,115 @@
-# Use this file to test all the other functions in the project.
+# Use this file to run all the other tools in the project.
+# Each tool's module is only imported once its subcommand is picked, so `python main.py --help` and friends
+# don't pay for the OpenAI SDK, dotenv and client setup of tools that never run.
+#
+#   python main.py                      -> asks for a task, like it always has (g = generate, v = variation)
+#   python main.py sentiment            -> runs one tool
+#   python main.py --import-time vision -> runs it, then reports where the import time went
+#   python main.py sentiment --stream   -> anything after a script tool's name is passed on to the script
 
-import image_generator
-import image_variation
+import argparse
+import builtins
+import os
+import runpy
+import sys
+import time
+from pathlib import Path
 
-task = input("Enter a task: ")
+PROJECT_DIR = Path(__file__).resolve().parent
 
-if task == "g":
-    image_generator.generate_image()
+# Tools that expose a function get imported and called; the rest are scripts that run top to bottom,
+# from their own directory since that's where they look for their files.
+TOOLS = {
+    "generate": {"module": "image_generator", "function": "generate_image",
+                 "help": "Generate an image from a prompt with DALL-E 2"},
+    "variation": {"module": "image_variation", "function": "create_variation",
+                  "help": "Create a variation of generated_image.jpg"},
+    "vision": {"script": "vision.py", "help": "Describe an image with GPT-4 Vision"},
+    "sentiment": {"script": "sentiment_analyzer.py", "help": "Classify the sentiment of a piece of text"},
+    "summarize": {"script": "Summarizer/summarizer.py", "help": "Summarize Summarizer/transcription.txt"},
+    "summarize-pipeline": {"script": "Summarizer/pipeline.py",
+                           "help": "Summarize, clarify and detail Summarizer/transcription.txt chunk by chunk"},
+    "equation": {"script": "EquationSolver/run.py", "help": "Turn a word problem into an equation and solve it"},
+    "story": {"script": "Storyteller/storyteller.py", "help": "Play through an interactive story"},
+}
 
-if task == "v":
-    image_variation.create_variation()
\ No newline at end of file
+# The single-letter tasks main.py has always accepted
+ALIASES = {"g": "generate", "v": "variation"}
+
+# Cumulative import time per top-level module, filled in by _timed_import when --import-time is on
+import_times = {}
+_original_import = builtins.__import__
+_import_depth = 0
+
+
+# Stand-in for __import__ that times each outermost import, so nested imports are counted toward
+# whatever pulled them in (e.g. openai's own imports are charged to whichever tool imported openai)
+def _timed_import(name, *args, **kwargs):
+    global _import_depth
+    if _import_depth:
+        return _original_import(name, *args, **kwargs)
+
+    _import_depth += 1
+    start = time.perf_counter()
+    try:
+        return _original_import(name, *args, **kwargs)
+    finally:
+        _import_depth -= 1
+        top_level = name.partition(".")[0] or name
+        import_times[top_level] = import_times.get(top_level, 0.0) + time.perf_counter() - start
+
+
+def print_import_report(total):
+    imported = sum(import_times.values())
+    print(f"\nImport time: {imported * 1000:.1f} ms of {total * 1000:.1f} ms total")
+    for name, seconds in sorted(import_times.items(), key=lambda item: item[1], reverse=True):
+        if seconds >= 0.0005:
+            print(f"  {seconds * 1000:8.1f} ms  {name}")
+
+
+def run_tool(name, script_args=()):
+    tool = TOOLS[name]
+    if "module" in tool:
+        module = __import__(tool["module"])
+        getattr(module, tool["function"])()
+        return
+
+    script = PROJECT_DIR / tool["script"]
+    os.chdir(script.parent)
+    sys.path.insert(0, str(script.parent))
+    # The script sees its own arguments, as if it had been run directly
+    sys.argv = [str(script), *script_args]
+    runpy.run_path(str(script), run_name="__main__")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run one of the OpenAI-API tools")
+    parser.add_argument("--import-time", action="store_true",
+                        help="report how long each imported module took to load once the tool finishes")
+    subparsers = parser.add_subparsers(dest="task", metavar="task")
+    for name, tool in TOOLS.items():
+        subparsers.add_parser(name, help=tool["help"],
+                              aliases=[alias for alias, target in ALIASES.items() if target == name])
+    # Anything main.py doesn't recognise is left for the script
+    args, script_args = parser.parse_known_args(argv)
+
+    task = args.task or input("Enter a task: ")
+    task = ALIASES.get(task, task)
+    if task not in TOOLS:
+        parser.error(f"unknown task {task!r}, pick one of: {', '.join(TOOLS)}")
+    if script_args and "script" not in TOOLS[task]:
+        parser.error(f"unrecognized arguments: {' '.join(script_args)}")
+
+    start = time.perf_counter()
+    if args.import_time:
+        builtins.__import__ = _timed_import
+    try:
+        run_tool(task, script_args)
+    finally:
+        if args.import_time:
+            builtins.__import__ = _original_import
+            print_import_report(time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,402 @@
+# Client-side pacing for the OpenAI rate limits, shared by every client client_factory hands out.
+# Each model gets two token buckets, one for requests per minute and one for tokens per minute. A request
+# reserves its share of both before it's sent (its token cost estimated with token_splitter) and sleeps off any
+# shortfall, so a bulk run settles at the account limit instead of bursting into 429s.
+# When a 429 or 5xx comes back anyway, the call is retried after the Retry-After the server asked for or,
+# failing that, a jittered exponential backoff, and the model's buckets are paused so every caller backs off.
+#
+# Limits come from MODEL_RATE_LIMITS, then openai_rpm / openai_tpm in the .env file for everything else.
+# Setting openai_rate_limit_db to a file path keeps the buckets in that SQLite file instead of in memory, so
+# several worker processes on one box draw from the same budget and split it between them.
+
+import asyncio
+import email.utils
+import functools
+import os
+import random
+import sqlite3
+import struct
+import threading
+import time
+from pathlib import Path
+
+import openai
+
+import token_splitter
+
+# Per-model limits, e.g. {"gpt-4o": {"rpm": 500, "tpm": 30000}}; use configure() to change them at runtime
+MODEL_RATE_LIMITS = {}
+
+# Retry settings for 429s, 5xx and connection errors
+MAX_RETRIES = 6
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+
+# Token cost assumed for an image passed by URL, where the size isn't known without fetching it, or inline in a
+# format whose size can't be read (a 1024x1024 image at high detail)
+REMOTE_IMAGE_TOKENS = 765
+
+# Endpoints that get paced and retried, as (path to the method, whether it's billed in tokens)
+LIMITED_ENDPOINTS = [
+    (("chat", "completions", "create"), True),
+    (("embeddings", "create"), True),
+    (("images", "generate"), False),
+    (("images", "create_variation"), False),
+    (("audio", "transcriptions", "create"), False),
+    (("audio", "translations", "create"), False),
+]
+
+
+class TokenBucket:
+    def __init__(self, capacity, refill_per_second):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.refill_per_second)
+        self._last = now
+
+    # Take `amount` from the bucket and return how long the caller has to wait before it's covered.
+    # The bucket is allowed to go into debt, so callers are served in the order they reserved.
+    def reserve(self, amount):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= amount
+            return -self.tokens / self.refill_per_second if self.tokens < 0 else 0.0
+
+    # Throw away any saved-up burst, e.g. after the server answered with a 429, so traffic restarts at the
+    # refill rate instead of all at once
+    def drain(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, 0)
+
+
+# Bucket and pause state kept in a SQLite file, so every process that opens the same file shares it.
+# Each update runs in an IMMEDIATE transaction, which takes SQLite's write lock, so reservations from different
+# processes are applied one at a time, in the order they arrive. Wall-clock time is used since
+# monotonic clocks aren't comparable between processes.
+class SharedStateStore:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # sqlite3 connections can't be shared between threads, so each thread opens its own
+        self._local = threading.local()
+        db = self._connect()
+        db.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, "
+                   "updated REAL NOT NULL)")
+        db.execute("CREATE TABLE IF NOT EXISTS pauses (model TEXT PRIMARY KEY, until REAL NOT NULL)")
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+        return db
+
+    # Same reservation as TokenBucket.reserve, against the shared row for `key`
+    def reserve(self, key, capacity, refill_per_second, amount):
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = db.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * refill_per_second)
+            tokens -= amount
+            db.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return -tokens / refill_per_second if tokens < 0 else 0.0
+
+    def drain(self, key):
+        db = self._connect()
+        db.execute("UPDATE buckets SET tokens = MIN(tokens, 0) WHERE key = ?", (key,))
+
+    def pause(self, model, seconds):
+        db = self._connect()
+        db.execute("INSERT INTO pauses (model, until) VALUES (?, ?) "
+                   "ON CONFLICT (model) DO UPDATE SET until = MAX(until, excluded.until)",
+                   (model, time.time() + seconds))
+
+    # Seconds left on a model's pause, 0 if it isn't paused
+    def paused_for(self, model):
+        row = self._connect().execute("SELECT until FROM pauses WHERE model = ?", (model,)).fetchone()
+        return max(row[0] - time.time(), 0.0) if row else 0.0
+
+
+# A TokenBucket whose state lives in a SharedStateStore
+class SharedTokenBucket:
+    def __init__(self, store, key, capacity, refill_per_second):
+        self.store = store
+        self.key = key
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+
+    def reserve(self, amount):
+        return self.store.reserve(self.key, self.capacity, self.refill_per_second, amount)
+
+    def drain(self):
+        # Bring the row up to date first, so the refill since its last use isn't lost and then re-added
+        self.store.reserve(self.key, self.capacity, self.refill_per_second, 0)
+        self.store.drain(self.key)
+
+
+class RateLimiter:
+    def __init__(self, default_rpm=None, default_tpm=None, store=None):
+        """
+        Args:
+            default_rpm: Requests per minute for models not in MODEL_RATE_LIMITS, or None for no limit
+            default_tpm: Tokens per minute for models not in MODEL_RATE_LIMITS, or None for no limit
+            store: SharedStateStore to keep the buckets in, or None to keep them in this process
+        """
+        self.default_rpm = default_rpm
+        self.default_tpm = default_tpm
+        self.store = store
+        self.waited = 0.0
+        self.retries = 0
+        self._buckets = {}
+        # Per-model pauses after a 429, which apply even when no limits are configured for the model
+        self._paused_until = {}
+        # Called as listener(model, seconds) on every 429, e.g. so the adaptive concurrency limit can back off
+        self.listeners = []
+        self._lock = threading.Lock()
+
+    def configure(self, model, rpm=None, tpm=None):
+        with self._lock:
+            MODEL_RATE_LIMITS[model] = {"rpm": rpm, "tpm": tpm}
+            self._buckets.pop(model, None)
+
+    # (requests bucket, tokens bucket) for a model, either of which is None when that limit isn't set
+    def _get_buckets(self, model):
+        buckets = self._buckets.get(model)
+        if buckets is None:
+            with self._lock:
+                buckets = self._buckets.get(model)
+                if buckets is None:
+                    limits = MODEL_RATE_LIMITS.get(model, {})
+                    rpm = limits.get("rpm", self.default_rpm)
+                    tpm = limits.get("tpm", self.default_tpm)
+                    buckets = (self._make_bucket(f"{model}:rpm", rpm), self._make_bucket(f"{model}:tpm", tpm))
+                    self._buckets[model] = buckets
+        return buckets
+
+    def _make_bucket(self, key, per_minute):
+        if not per_minute:
+            return None
+        if self.store is not None:
+            return SharedTokenBucket(self.store, key, per_minute, per_minute / 60)
+        return TokenBucket(per_minute, per_minute / 60)
+
+    # Reserve one request and `tokens` tokens for a model, returning how long to wait before sending
+    def reserve(self, model, tokens=0):
+        requests_bucket, tokens_bucket = self._get_buckets(model)
+        if self.store is not None:
+            wait = self.store.paused_for(model)
+        else:
+            wait = max(self._paused_until.get(model, 0.0) - time.monotonic(), 0.0)
+        if requests_bucket is not None:
+            wait = max(wait, requests_bucket.reserve(1))
+        if tokens_bucket is not None and tokens:
+            wait = max(wait, tokens_bucket.reserve(tokens))
+        self.waited += wait
+        return wait
+
+    def acquire(self, model, tokens=0):
+        wait = self.reserve(model, tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, model, tokens=0):
+        wait = self.reserve(model, tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    # Hold back every request for a model, after the server said it's over the limit
+    def pause(self, model, seconds):
+        if self.store is not None:
+            self.store.pause(model, seconds)
+        else:
+            with self._lock:
+                self._paused_until[model] = max(self._paused_until.get(model, 0.0), time.monotonic() + seconds)
+        for bucket in self._get_buckets(model):
+            if bucket is not None:
+                bucket.drain()
+        for listener in self.listeners:
+            listener(model, seconds)
+
+
+# Token cost of a request, as the rate limiter sees it: the prompt plus the completion it may produce
+def estimate_request_tokens(model, kwargs):
+    if "messages" in kwargs:
+        texts = []
+        image_tokens = 0
+        for message in kwargs["messages"]:
+            content = message.get("content") or ""
+            if isinstance(content, str):
+                texts.append(content)
+                continue
+            for part in content:
+                if part.get("type") == "text":
+                    texts.append(part["text"])
+                elif part.get("type") == "image_url":
+                    image = part["image_url"]
+                    url = image["url"] if isinstance(image, dict) else image
+                    detail = image.get("detail", "auto") if isinstance(image, dict) else "auto"
+                    image_tokens += _image_tokens(model, url, detail)
+        prompt_tokens = (token_splitter.TOKENS_PER_REPLY + token_splitter.TOKENS_PER_MESSAGE * len(texts)
+                         + _count_tokens(model, texts) + image_tokens)
+        completion_tokens = kwargs.get("max_tokens") or kwargs.get("max_completion_tokens") or 0
+        return prompt_tokens + completion_tokens
+
+    if "input" in kwargs:
+        inputs = kwargs["input"]
+        return _count_tokens(model, [inputs] if isinstance(inputs, str) else list(inputs))
+    return 0
+
+
+# Token cost of one image in a request. Only an estimate for pacing, so an image that can't be sized locally gets
+# the fixed high-detail cost instead of failing a request the API may well accept.
+def _image_tokens(model, url, detail):
+    fallback = token_splitter.DEFAULT_IMAGE_TOKEN_COST["base"] if detail == "low" else REMOTE_IMAGE_TOKENS
+    # Local images are sent inline, so their header is right there to read
+    if url.startswith("data:"):
+        try:
+            return token_splitter.getImageTokenSize(model, url, detail)
+        except (ValueError, IndexError, struct.error):
+            return fallback
+    return fallback
+
+
+# Encoded one after another: these are a single request's texts, too few to be worth count_tokens_batch's threads
+def _count_tokens(model, texts):
+    try:
+        encoding = token_splitter.get_encoding(model)
+    except KeyError:
+        # tiktoken doesn't know the model; roughly four characters per token is close enough for pacing
+        return sum(len(text) for text in texts) // 4
+    return sum(len(encoding.encode_ordinary(text)) for text in texts)
+
+
+# Seconds the server asked us to wait, from Retry-After / retry-after-ms, or None if it didn't say
+def retry_after_seconds(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        # Neither seconds nor a date; back off as if the server hadn't said
+        return None
+    return max(parsed.timestamp() - time.time(), 0.0) if parsed else None
+
+
+def _should_retry(error):
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+# Full-jitter exponential backoff, unless the server said exactly how long to wait
+def _retry_delay(error, attempt):
+    retry_after = retry_after_seconds(error)
+    if retry_after is not None:
+        return min(retry_after, MAX_DELAY)
+    return random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** attempt))
+
+
+def _limited(limiter, method, billed_in_tokens):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        model = kwargs.get("model", "")
+        tokens = estimate_request_tokens(model, kwargs) if billed_in_tokens else 0
+        for attempt in range(MAX_RETRIES + 1):
+            limiter.acquire(model, tokens)
+            try:
+                return method(*args, **kwargs)
+            except openai.APIError as error:
+                if attempt == MAX_RETRIES or not _should_retry(error):
+                    raise
+                delay = _retry_delay(error, attempt)
+                limiter.retries += 1
+                if isinstance(error, openai.RateLimitError):
+                    limiter.pause(model, delay)
+                else:
+                    time.sleep(delay)
+    return wrapper
+
+
+def _limited_async(limiter, method, billed_in_tokens):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        model = kwargs.get("model", "")
+        tokens = estimate_request_tokens(model, kwargs) if billed_in_tokens else 0
+        for attempt in range(MAX_RETRIES + 1):
+            await limiter.acquire_async(model, tokens)
+            try:
+                return await method(*args, **kwargs)
+            except openai.APIError as error:
+                if attempt == MAX_RETRIES or not _should_retry(error):
+                    raise
+                delay = _retry_delay(error, attempt)
+                limiter.retries += 1
+                if isinstance(error, openai.RateLimitError):
+                    limiter.pause(model, delay)
+                else:
+                    await asyncio.sleep(delay)
+    return wrapper
+
+
+def _env_limit(name):
+    value = os.getenv(name)
+    return float(value) if value else None
+
+
+_default_limiter = None
+_default_limiter_lock = threading.Lock()
+
+
+# The process-wide limiter, built from openai_rpm / openai_tpm (and openai_rate_limit_db, to share it with other
+# processes) the first time it's needed
+def get_limiter():
+    global _default_limiter
+    if _default_limiter is None:
+        with _default_limiter_lock:
+            if _default_limiter is None:
+                db_path = os.getenv("openai_rate_limit_db")
+                store = SharedStateStore(db_path) if db_path else None
+                _default_limiter = RateLimiter(_env_limit("openai_rpm"), _env_limit("openai_tpm"), store)
+    return _default_limiter
+
+
+# Pace and retry every rate-limited endpoint of a client through the shared limiter.
+# The client's own retries should be turned off (max_retries=0) so the two don't stack.
+def limit_client(client, is_async=False, limiter=None):
+    limiter = limiter or get_limiter()
+    for path, billed_in_tokens in LIMITED_ENDPOINTS:
+        resource = client
+        for name in path[:-1]:
+            resource = getattr(resource, name)
+        method = getattr(resource, path[-1])
+        wrap = _limited_async if is_async else _limited
+        setattr(resource, path[-1], wrap(limiter, method, billed_in_tokens))
+    return client
@@ -0,0 +1,125 @@
+# Single-flight deduplication for chat completions. When identical requests (same model, messages and
+# parameters, hashed like response_cache does) are made at the same moment from several threads or coroutines,
+# only the first one goes upstream; the rest wait for it and get the same response object back, or the same
+# error. Nothing is kept once that request finishes, so this only removes duplicates that are in flight right now.
+# For answers that should outlive the call, use response_cache.
+#
+# client_factory applies it to every client it hands out unless openai_coalesce_requests is turned off.
+
+import asyncio
+import functools
+import hashlib
+import threading
+
+import response_cache
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self.leaders = 0
+        self.coalesced = 0
+        self._calls = {}
+        # Async calls are keyed by (event loop, request key), since a task can only be awaited on its own loop
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    # Call fn(), unless a call with the same key is already running, in which case wait for its result
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    # Same as do, for a coroutine function. The upstream call runs as its own task, so one waiter being
+    # cancelled doesn't cancel it for the others.
+    async def do_async(self, key, coroutine_fn):
+        key = (asyncio.get_running_loop(), key)
+        with self._lock:
+            task = self._tasks.get(key)
+            if task is None:
+                task = self._tasks[key] = asyncio.ensure_future(coroutine_fn())
+                task.add_done_callback(lambda _: self._forget(key))
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key):
+        with self._lock:
+            self._tasks.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            calls = self.leaders + self.coalesced
+            return {
+                "upstream_calls": self.leaders,
+                "coalesced_calls": self.coalesced,
+                "coalesced_rate": self.coalesced / calls if calls else 0.0,
+            }
+
+
+# Shared by every client, so duplicates are caught across all of them
+single_flight = SingleFlight()
+
+
+# Which account and endpoint a client talks to, so requests are only coalesced with ones that would get the same
+# answer from the same place. The API key is hashed rather than kept in every flight key.
+def _client_identity(client):
+    identity = f"{client.api_key}\n{client.base_url}"
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest()[:16]
+
+
+def _coalesced(method, identity):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        # Every caller needs its own stream, so streaming requests always go upstream
+        if args or kwargs.get("stream"):
+            return method(*args, **kwargs)
+        return single_flight.do(f"{identity}:{response_cache.request_key(**kwargs)}", lambda: method(**kwargs))
+    return wrapper
+
+
+def _coalesced_async(method, identity):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        if args or kwargs.get("stream"):
+            return await method(*args, **kwargs)
+        return await single_flight.do_async(f"{identity}:{response_cache.request_key(**kwargs)}",
+                                            lambda: method(**kwargs))
+    return wrapper
+
+
+# Deduplicate a client's concurrent identical chat completions. Works for OpenAI and AsyncOpenAI.
+# Requests from clients with a different API key or base URL are never coalesced with each other.
+def coalesce_client(client, is_async=False):
+    completions = client.chat.completions
+    completions.create = (_coalesced_async if is_async else _coalesced)(completions.create, _client_identity(client))
+    return client
@@ -0,0 +1,152 @@
+# Persistent cache for chat completions, keyed by a hash of everything that decides the answer
+# (model, messages and sampling parameters). Backed by a SQLite file, with least-recently-used eviction once
+# it grows past its entry or size limit, and an optional time-to-live.
+#
+# Opt in per call by going through cached_completion instead of client.chat.completions.create:
+#
+#   response = response_cache.cached_completion(client, model="gpt-3.5-turbo", messages=[...], temperature=0.3)
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from openai.types.chat import ChatCompletion
+
+CACHE_DIR = Path(__file__).resolve().parent / "cache"
+DEFAULT_PATH = Path(os.getenv("openai_response_cache", CACHE_DIR / "responses.sqlite3"))
+
+# Keyword arguments that change how a request is sent, not what comes back
+_TRANSPORT_PARAMS = {"timeout", "extra_headers", "extra_query", "extra_body"}
+
+
+# Stable hash of a request: the same model, messages and parameters always give the same key
+def request_key(model, messages, **params):
+    params = {name: value for name, value in params.items() if name not in _TRANSPORT_PARAMS}
+    payload = json.dumps({"model": model, "messages": messages, "params": params},
+                         sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path=DEFAULT_PATH, max_entries=10000, max_bytes=256 * 1024 * 1024, ttl=None):
+        """
+        Args:
+            path: SQLite file to keep the cache in (created if missing)
+            max_entries: Most responses to keep before evicting the least recently used
+            max_bytes: Most bytes of responses to keep before evicting the least recently used
+            ttl: Seconds a response stays valid for, or None to keep it until it's evicted
+        """
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        # WAL lets several processes read while one writes; NORMAL sync is plenty for a cache
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def set(self, key, value):
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now, now),
+            )
+            self._evict()
+
+    # Drop least recently used responses until both limits are met again
+    def _evict(self):
+        count, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        while count > self.max_entries or (self.max_bytes is not None and size > self.max_bytes and count > 1):
+            key, entry_size = self._db.execute(
+                "SELECT key, size FROM responses ORDER BY last_used LIMIT 1"
+            ).fetchone()
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            count -= 1
+            size -= entry_size
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+# The process-wide cache at DEFAULT_PATH, opened the first time it's needed
+def get_cache():
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = ResponseCache()
+    return _default_cache
+
+
+# client.chat.completions.create, answered from the cache when the exact same request has been made before.
+# Pass use_cache=False to skip the cache for one call, or cache= to use a cache other than the default one.
+# Streaming requests always go straight to the API.
+def cached_completion(client, use_cache=True, cache=None, **kwargs):
+    if not use_cache or kwargs.get("stream"):
+        return client.chat.completions.create(**kwargs)
+
+    cache = cache or get_cache()
+    key = request_key(**kwargs)
+    cached = cache.get(key)
+    if cached is not None:
+        return ChatCompletion.model_validate_json(cached)
+
+    response = client.chat.completions.create(**kwargs)
+    cache.set(key, response.model_dump_json())
+    return response
@@ -1,25 +1,72 @@
+import argparse
 import os
-from pathlib import Path
+import sys
 
-from dotenv import load_dotenv
-from openai import OpenAI
+import client_factory
+import sentiment_lexicon
+import token_splitter
 
-path = Path("Environment-Variables/.env")
-load_dotenv(dotenv_path=path)
+# Set up the openai client (shared with the rest of the project)
+client = client_factory.get_client()
 
-# Set up the openai client
-client = OpenAI(
-    api_key=os.getenv("api_key")
-)
+model = "gpt-4-1106-preview"
+instructions = "What is the sentiment of this text? Respond with one of the following: Positive, Negative, Neutral, and rank it on a scale of 1 - 10 where 1 is heavily negative and 10 is heavily positive."
+
+# With --stream or --follow, classify a live feed in micro-batches instead of asking for one text
+parser = argparse.ArgumentParser(description="Classify the sentiment of a piece of text, or of a live feed")
+parser.add_argument("--stream", action="store_true", help="classify newline-delimited text from stdin")
+parser.add_argument("--follow", metavar="FILE", help="classify lines as they're appended to FILE, like tail -F")
+parser.add_argument("--from-start", action="store_true", help="with --follow, start from the top of FILE")
+parser.add_argument("--batch-size", type=int, default=20, help="most lines per request")
+parser.add_argument("--max-wait-ms", type=float, default=500, help="longest a batch waits to fill up")
+parser.add_argument("--max-latency", type=float, default=10.0,
+                    help="seconds before a line's result is due; late lines get the lexicon's guess")
+parser.add_argument("--concurrency", type=int, default=4, help="most batches in flight at once")
+args = parser.parse_args()
+
+if args.stream or args.follow:
+    import sentiment_stream
+
+    lines = sentiment_stream.follow(args.follow, args.from_start) if args.follow else sys.stdin
+    counts = sentiment_stream.run(lines, model=model, batch_size=args.batch_size, max_wait=args.max_wait_ms / 1000,
+                                  max_latency=args.max_latency, concurrency=args.concurrency)
+    print(f"Classified {counts['lines']} lines in {counts['batches']} requests, {counts['local']} locally, "
+          f"{counts['fallback']} fell back to the lexicon", file=sys.stderr)
+    raise SystemExit
+
+text = input("What text would you like to classify? ")
+
+# Obviously positive or negative texts are scored locally, with no API call at all.
+# Set sentiment_confidence_threshold in the .env file to tune how sure the lexicon has to be (above 1 disables it).
+local = sentiment_lexicon.scorer.classify(text)
+if local is not None:
+    print(f"{local['label']}, {local['score']}")
+    raise SystemExit
+
+# sentiment_engine=embedding in the .env file classifies with embeddings and a locally fitted classifier
+# (embedding_sentiment.py) instead of a chat completion
+if os.getenv("sentiment_engine", "chat") == "embedding":
+    import embedding_sentiment
+
+    result = embedding_sentiment.get_classifier().classify([text])[0]
+    print(f"{result['label']}, {result['score']}")
+    raise SystemExit
+
+# The answer is a label and a number, so there's no point reserving a big completion budget.
+# Check the text actually fits before paying for a round trip that ends in a context-length error.
+plan = token_splitter.plan_request(model, instructions, text, completion_tokens=20)
+if not plan["fits"]:
+    raise ValueError(f"Text is {plan['payload_tokens']} tokens, only {plan['payload_budget']} fit in {model}")
 
 # Generate response using davinci-003
 # Parameter meanings are listed in summarizer.py
 response = client.chat.completions.create(
-    model="gpt-4-1106-preview",
+    model=model,
     messages=[
-        {"role": "user", "content": "What is the sentiment of this text? Respond with one of the following: Positive, Negative, Neutral, and rank it on a scale of 1 - 10 where 1 is heavily negative and 10 is heavily positive."},
-        {"role": "user", "content": input("What text would you like to classify? ")}
-    ]
+        {"role": "user", "content": instructions},
+        {"role": "user", "content": text}
+    ],
+    max_tokens=plan["completion_tokens"]
 )
 
 # Print the response text
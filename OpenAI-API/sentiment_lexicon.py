@@ -0,0 +1,139 @@
+# Local sentiment scoring for texts that are obviously positive or negative, so they don't need a round trip to
+# the model. Word valences from a small lexicon are summed with the usual adjustments (negation flips the next few
+# words, intensifiers and dampeners scale them, the clause after "but" outweighs the one before it) and squashed
+# into a compound score between -1 and 1, which maps onto the same 1 - 10 scale the sentiment prompt asks for.
+#
+# Confidence is the compound's strength times how one-sided the evidence is, so mixed texts ("great screen,
+# terrible battery") score low and get deferred to the model:
+#
+#   result = sentiment_lexicon.scorer.classify(text)
+#   if result is None:
+#       ...ask the model...
+
+import math
+import os
+import re
+import threading
+
+# Word valences from -4 (heavily negative) to 4 (heavily positive)
+LEXICON = {
+    # Positive
+    "amazing": 3.1, "awesome": 3.1, "beautiful": 2.9, "best": 3.2, "brilliant": 2.8, "delighted": 3.2,
+    "delightful": 2.9, "enjoy": 2.2, "enjoyed": 2.3, "excellent": 3.2, "exceptional": 3.0, "fantastic": 3.3,
+    "favorite": 2.0, "favourite": 2.0, "fine": 0.8, "flawless": 2.9, "glad": 2.0, "good": 1.9, "gorgeous": 3.0,
+    "great": 3.1, "happy": 2.7, "helpful": 1.8, "impressed": 2.2, "impressive": 2.4, "incredible": 2.9,
+    "like": 1.3, "liked": 1.6, "love": 3.2, "loved": 2.9, "lovely": 2.8, "nice": 1.8, "perfect": 2.7,
+    "perfectly": 2.4, "pleasant": 2.3, "pleased": 2.1, "recommend": 1.9, "recommended": 1.8, "reliable": 1.9,
+    "satisfied": 1.8, "smooth": 1.4, "solid": 1.3, "superb": 3.1, "thanks": 1.9, "thank": 1.5, "works": 1.0,
+    "wonderful": 2.9, "worth": 1.3,
+    # Negative
+    "annoying": -2.1, "awful": -3.1, "bad": -2.5, "broke": -2.0, "broken": -2.2, "cheap": -1.1, "complaint": -1.8,
+    "crap": -2.8, "defective": -2.4, "disappointed": -2.3, "disappointing": -2.4, "disgusting": -3.0,
+    "dislike": -1.9, "expensive": -1.1, "fail": -2.4, "failed": -2.3, "faulty": -2.2, "garbage": -2.9,
+    "hate": -2.7, "hated": -2.7, "horrible": -3.2, "junk": -2.5, "mediocre": -1.6, "misleading": -2.2,
+    "pathetic": -2.8, "poor": -2.1, "poorly": -2.0, "problem": -1.7, "problems": -1.7, "refund": -1.5,
+    "return": -0.9, "returned": -1.5, "rude": -2.4, "sad": -2.1, "scam": -3.2, "slow": -1.3, "terrible": -3.1,
+    "ugly": -2.3, "unhappy": -2.3, "unreliable": -2.2, "useless": -2.7, "waste": -2.6, "worse": -2.5,
+    "worst": -3.1, "wrong": -2.1,
+}
+
+NEGATIONS = {"not", "no", "never", "none", "nothing", "neither", "nor", "cannot", "without", "isn't", "wasn't",
+             "aren't", "weren't", "don't", "doesn't", "didn't", "won't", "wouldn't", "can't", "couldn't",
+             "shouldn't", "hardly"}
+BOOSTERS = {"very": 1.3, "really": 1.3, "extremely": 1.5, "so": 1.2, "absolutely": 1.5, "totally": 1.4,
+            "completely": 1.4, "incredibly": 1.5, "super": 1.3, "most": 1.2, "highly": 1.4}
+DAMPENERS = {"somewhat": 0.7, "slightly": 0.6, "kinda": 0.7, "fairly": 0.8, "pretty": 0.9, "almost": 0.7,
+             "barely": 0.5, "little": 0.7}
+
+# How many words back a negation reaches, and how much it flips and shrinks what it negates ("not bad" is mildly
+# positive, not as positive as "good")
+NEGATION_SCOPE = 3
+NEGATION_FACTOR = -0.74
+# Normalizer for the compound score; larger means it takes more evidence to approach -1 or 1
+ALPHA = 15.0
+
+# Texts below this confidence go to the model, overridable from the environment
+DEFAULT_THRESHOLD = float(os.getenv("sentiment_confidence_threshold", "0.6"))
+
+_WORD = re.compile(r"[a-z]+(?:'[a-z]+)?|!")
+
+
+# Lexicon score for a text: {"compound", "label", "score" (1 - 10), "confidence" (0 - 1)}
+def score(text):
+    tokens = _WORD.findall(text.lower())
+    valences = []
+    for i, token in enumerate(tokens):
+        valence = LEXICON.get(token)
+        if valence is None:
+            continue
+        previous = tokens[max(i - NEGATION_SCOPE, 0):i]
+        if previous:
+            valence *= BOOSTERS.get(previous[-1], 1.0) * DAMPENERS.get(previous[-1], 1.0)
+        if any(word in NEGATIONS or word.endswith("n't") for word in previous):
+            valence *= NEGATION_FACTOR
+        valences.append((i, valence))
+
+    # The clause after "but" is what the writer ends up meaning
+    if "but" in tokens:
+        but = tokens.index("but")
+        valences = [(i, valence * (0.5 if i < but else 1.5)) for i, valence in valences]
+
+    total = sum(valence for _, valence in valences)
+    if total:
+        # Each "!" adds a little emphasis in whichever direction the text already leans
+        total += math.copysign(min(tokens.count("!"), 4) * 0.29, total)
+    compound = total / math.sqrt(total * total + ALPHA)
+
+    positive = sum(valence for _, valence in valences if valence > 0)
+    negative = -sum(valence for _, valence in valences if valence < 0)
+    agreement = abs(positive - negative) / (positive + negative) if positive + negative else 0.0
+
+    if compound >= 0.05:
+        label = "Positive"
+    elif compound <= -0.05:
+        label = "Negative"
+    else:
+        label = "Neutral"
+    return {
+        "compound": compound,
+        "label": label,
+        "score": min(max(round(5.5 + 4.5 * compound), 1), 10),
+        "confidence": abs(compound) * agreement,
+    }
+
+
+class LexiconScorer:
+    def __init__(self, threshold=DEFAULT_THRESHOLD):
+        """
+        Args:
+            threshold: Lowest confidence answered locally; anything less is left for the model.
+                       Above 1 sends everything to the model.
+        """
+        self.threshold = threshold
+        self.local = 0
+        self.deferred = 0
+        self._lock = threading.Lock()
+
+    # The lexicon's answer if it's confident enough, otherwise None
+    def classify(self, text):
+        result = score(text)
+        confident = result["confidence"] >= self.threshold
+        with self._lock:
+            if confident:
+                self.local += 1
+            else:
+                self.deferred += 1
+        return result if confident else None
+
+    def stats(self):
+        with self._lock:
+            total = self.local + self.deferred
+            return {
+                "calls_avoided": self.local,
+                "sent_to_model": self.deferred,
+                "avoided_rate": self.local / total if total else 0.0,
+            }
+
+
+# Shared scorer using DEFAULT_THRESHOLD
+scorer = LexiconScorer()
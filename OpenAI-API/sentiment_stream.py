@@ -0,0 +1,196 @@
+# Streaming sentiment for live feeds: newline-delimited text from stdin or a file being appended to (like tail -f),
+# classified in micro-batches and written to stdout as JSON lines, in the same order the lines came in.
+#
+#   tail -F app.log | python sentiment_analyzer.py --stream
+#   python sentiment_analyzer.py --follow reviews.log --batch-size 50 --max-wait-ms 500
+#
+# A batch closes when it has batch_size lines or max_wait has passed since its first line, and goes to the model
+# as one packed request (bulk_sentiment.classify_pack), minus any lines the lexicon already answered. If a batch
+# isn't back within max_latency of its first line arriving, its lines get the lexicon's best guess instead
+# (marked "source": "fallback"), so no line waits longer than that. When the model falls behind, the queues
+# between the stages fill up and reading stops, which pushes back on whatever is writing to stdin.
+
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+
+import bulk_sentiment
+import sentiment_lexicon
+
+
+# Lines appended to a file, waiting for more at the end like tail -F. Starts from the end unless from_start,
+# and reopens the file when it's rotated or truncated.
+def follow(path, from_start=False, poll_interval=0.2):
+    file = open(path, encoding="utf-8", errors="replace")
+    if not from_start:
+        file.seek(0, os.SEEK_END)
+    partial = ""
+    try:
+        while True:
+            line = file.readline()
+            if line:
+                partial += line
+                if partial.endswith("\n"):
+                    yield partial
+                    partial = ""
+                continue
+            try:
+                rotated = os.stat(path).st_ino != os.fstat(file.fileno()).st_ino \
+                    or os.stat(path).st_size < file.tell()
+            except FileNotFoundError:
+                rotated = False
+            if rotated:
+                file.close()
+                file = open(path, encoding="utf-8", errors="replace")
+                partial = ""
+            else:
+                time.sleep(poll_interval)
+    finally:
+        file.close()
+
+
+# Feed lines from a blocking iterator into an asyncio queue from a background thread. put() blocks the thread
+# while the queue is full, so a slow consumer stops the reading. None marks the end of the input.
+def _start_reader(lines, queue, loop, stop):
+    def read():
+        try:
+            for line in lines:
+                if stop.is_set():
+                    break
+                asyncio.run_coroutine_threadsafe(queue.put((time.monotonic(), line.rstrip("\r\n"))), loop).result()
+        finally:
+            if not stop.is_set():
+                asyncio.run_coroutine_threadsafe(queue.put(None), loop).result()
+
+    thread = threading.Thread(target=read, name="sentiment-stream-reader", daemon=True)
+    thread.start()
+    return thread
+
+
+class MicroBatcher:
+    def __init__(self, model="gpt-4-1106-preview", batch_size=20, max_wait=0.5, max_latency=10.0,
+                 max_pending=1000, concurrency=4, scorer=sentiment_lexicon.scorer, out=sys.stdout):
+        """
+        Args:
+            model: Chat model for the lines the lexicon isn't sure about
+            batch_size: Most lines per request
+            max_wait: Seconds a batch stays open after its first line before it's sent anyway
+            max_latency: Seconds from a line arriving to its result being due; late batches fall back to the lexicon
+            max_pending: Lines read but not yet batched before reading stops
+            concurrency: Batches in flight at once before batching stops
+            scorer: LexiconScorer for the fast path, or None to send every line to the model
+            out: Where the JSON lines are written
+        """
+        self.model = model
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.max_latency = max_latency
+        self.max_pending = max_pending
+        self.concurrency = concurrency
+        self.scorer = scorer
+        self.out = out
+        self.counts = {"lines": 0, "batches": 0, "local": 0, "fallback": 0}
+        self._line_number = 0
+
+    # Classify every line from a blocking iterator (sys.stdin, follow(...)) until it runs out
+    async def run(self, lines):
+        loop = asyncio.get_running_loop()
+        incoming = asyncio.Queue(self.max_pending)
+        # Batches in input order, for the writer
+        in_flight = asyncio.Queue(self.concurrency)
+        # Held by each running batch, so batching waits when `concurrency` of them are still running. The queue
+        # alone doesn't bound that: the writer takes a batch off it before the batch has finished.
+        slots = asyncio.Semaphore(self.concurrency)
+        stop = threading.Event()
+        _start_reader(lines, incoming, loop, stop)
+        writer = asyncio.ensure_future(self._write_results(in_flight))
+        try:
+            await self._make_batches(incoming, in_flight, slots)
+            await in_flight.put(None)
+            await writer
+        finally:
+            stop.set()
+            writer.cancel()
+        return self.counts
+
+    async def _make_batches(self, incoming, in_flight, slots):
+        while True:
+            item = await incoming.get()
+            if item is None:
+                return
+            self._line_number += 1
+            batch = [(self._line_number, *item)]
+            deadline = item[0] + self.max_wait
+            finished = False
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(incoming.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    finished = True
+                    break
+                self._line_number += 1
+                batch.append((self._line_number, *item))
+            await slots.acquire()
+            task = asyncio.ensure_future(self._classify_batch(batch))
+            task.add_done_callback(lambda _: slots.release())
+            await in_flight.put(task)
+            if finished:
+                return
+
+    # Classify (line number, arrival time, text) tuples, returning a result per line in the same order
+    async def _classify_batch(self, batch):
+        first_arrival = batch[0][1]
+        results = []
+        deferred = []
+        for line_number, _, text in batch:
+            result = {"line": line_number, "text": text}
+            local = self.scorer.classify(text) if self.scorer is not None and text.strip() else None
+            if local is not None:
+                result.update(label=local["label"], score=local["score"], source="lexicon")
+                self.counts["local"] += 1
+            elif text.strip():
+                deferred.append((str(len(results)), text))
+            else:
+                result.update(label="Neutral", score=5, source="empty")
+            results.append(result)
+
+        if deferred:
+            self.counts["batches"] += 1
+            timeout = first_arrival + self.max_latency - time.monotonic()
+            try:
+                answers = await asyncio.wait_for(bulk_sentiment.classify_pack(deferred, self.model), max(timeout, 0))
+            except asyncio.TimeoutError:
+                answers = [{"id": index, "error": "timed out"} for index, _ in deferred]
+            for answer in answers:
+                result = results[int(answer["id"])]
+                if "error" in answer:
+                    # Late or failed: the lexicon's guess now beats a better answer after the deadline
+                    guess = sentiment_lexicon.score(result["text"])
+                    result.update(label=guess["label"], score=guess["score"], source="fallback",
+                                  error=answer["error"])
+                    self.counts["fallback"] += 1
+                else:
+                    result.update(label=answer["label"], score=answer["score"], source="model")
+        self.counts["lines"] += len(results)
+        return results
+
+    async def _write_results(self, in_flight):
+        while True:
+            task = await in_flight.get()
+            if task is None:
+                return
+            for result in await task:
+                self.out.write(json.dumps(result) + "\n")
+            self.out.flush()
+
+
+def run(lines, **settings):
+    return asyncio.run(MicroBatcher(**settings).run(lines))
@@ -0,0 +1,36 @@
+# Streaming chat completions for the interactive scripts, so the reply is printed as it's generated instead of
+# after the whole completion has arrived. The full text is still returned for conversation histories and
+# follow-up passes.
+#
+#   reply, ttft = streaming.stream_chat(client, model="gpt-3.5-turbo-1106", messages=conversation_history)
+
+import sys
+import time
+
+
+# Send a chat completion with stream=True and write each piece of the reply to `out` as it arrives.
+# Returns the full reply and the seconds until its first token arrived (None if the reply was empty).
+def stream_chat(client, out=sys.stdout, **kwargs):
+    start = time.perf_counter()
+    ttft = None
+    parts = []
+    # include_usage adds a final chunk with the token counts, which instrumentation picks up
+    with client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **kwargs) as stream:
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            text = chunk.choices[0].delta.content
+            if text:
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                parts.append(text)
+                out.write(text)
+                out.flush()
+    out.write("\n")
+    return "".join(parts), ttft
+
+
+# One-line report of how long the reply took to start, on stderr so it stays out of the reply itself
+def report_ttft(ttft, label="reply"):
+    if ttft is not None:
+        print(f"[{label}: first token after {ttft * 1000:.0f} ms]", file=sys.stderr)
@@ -1,12 +1,453 @@
+import base64
+import io
+import math
+import os
+import re
+import struct
+import sys
+import threading
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# tiktoken downloads its BPE files on first use unless they're already in its cache directory.
+# Point it at a directory inside the project so the files can be vendored (see vendor_encodings) and
+# shipped to hosts without internet access. An existing TIKTOKEN_CACHE_DIR setting still wins.
+ENCODING_CACHE_DIR = Path(os.environ.setdefault("TIKTOKEN_CACHE_DIR",
+                                                str(Path(__file__).resolve().parent / "tiktoken-cache")))
+
 import tiktoken
+import tiktoken.model
+
+# Paragraph breaks first, then whitespace following the end of a sentence. CJK text doesn't put spaces between
+# sentences, so its full-width stops are a boundary by themselves.
+_BOUNDARY = re.compile(r"\n[ \t]*\n\s*|(?<=[.!?])\s+|(?<=[。！？])\s*")
+
+# Context window and maximum completion size, in tokens, for the models used around the project.
+# Dated snapshots fall back to the longest matching prefix (e.g. gpt-4o-2024-08-06 -> gpt-4o).
+MODEL_LIMITS = {
+    "gpt-3.5-turbo": {"context_window": 16385, "max_output_tokens": 4096},
+    "gpt-3.5-turbo-1106": {"context_window": 16385, "max_output_tokens": 4096},
+    "gpt-4": {"context_window": 8192, "max_output_tokens": 8192},
+    "gpt-4-1106-preview": {"context_window": 128000, "max_output_tokens": 4096},
+    "gpt-4-0125-preview": {"context_window": 128000, "max_output_tokens": 4096},
+    "gpt-4-vision-preview": {"context_window": 128000, "max_output_tokens": 4096},
+    "gpt-4-turbo": {"context_window": 128000, "max_output_tokens": 4096},
+    "gpt-4o": {"context_window": 128000, "max_output_tokens": 16384},
+    "gpt-4o-mini": {"context_window": 128000, "max_output_tokens": 16384},
+}
+
+# Image inputs are billed per 512px tile plus a flat base cost (the base cost alone for detail="low").
+# Models not listed here use the gpt-4o / gpt-4-vision numbers.
+IMAGE_TOKEN_COSTS = {
+    "gpt-4o-mini": {"base": 2833, "tile": 5667},
+}
+DEFAULT_IMAGE_TOKEN_COST = {"base": 85, "tile": 170}
+
+# Every chat message carries a few tokens of framing, and the reply is primed with a few more
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+# Building an encoding is expensive, so keep one per model for the whole process.
+# tiktoken encodings are safe to share between threads once built.
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+# Get the cached encoding for a model, building it the first time it's asked for
+def get_encoding(model):
+    encoding = _encodings.get(model)
+    if encoding is None:
+        with _encodings_lock:
+            # Another thread may have built it while we were waiting on the lock
+            encoding = _encodings.get(model)
+            if encoding is None:
+                encoding = tiktoken.encoding_for_model(model)
+                _encodings[model] = encoding
+    return encoding
 
 
 # Get input size in tokens
 def getInputTokenSize(model, input_message):
-    encoding = tiktoken.encoding_for_model(model)
+    encoding = get_encoding(model)
     tokenized = encoding.encode(input_message)
     length = len(tokenized)
 
     returned_list = [length, encoding.max_token_value]
 
     return returned_list
+
+
+# Count tokens for a list of strings, returned as an array of counts in the same order.
+# tiktoken's encoder releases the GIL, so the threads actually run in parallel across cores.
+def count_tokens_batch(model, input_messages, num_threads=None):
+    encoding = get_encoding(model)
+    input_messages = list(input_messages)
+    counts = array("q", bytes(8 * len(input_messages)))
+    if not input_messages:
+        return counts
+
+    num_threads = min(num_threads or os.cpu_count() or 1, len(input_messages))
+
+    # Each worker fills its own contiguous slice, so no locking is needed on the results
+    def count_slice(start, stop):
+        for i in range(start, stop):
+            counts[i] = len(encoding.encode_ordinary(input_messages[i]))
+
+    if num_threads == 1:
+        count_slice(0, len(input_messages))
+        return counts
+
+    step = -(-len(input_messages) // num_threads)
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        futures = [executor.submit(count_slice, start, min(start + step, len(input_messages)))
+                   for start in range(0, len(input_messages), step)]
+        for future in futures:
+            future.result()
+
+    return counts
+
+
+# Split an open text file into sentence/paragraph-sized segments without reading it all at once.
+# Yields (text, ends_paragraph). Text with no boundary in sight is force-cut at whitespace once the
+# buffer grows past max_segment_chars, so memory stays bounded no matter what the file looks like.
+def _iter_segments(file, block_size, max_segment_chars):
+    buffer = ""
+    while True:
+        block = file.read(block_size)
+        buffer += block
+        start = 0
+        for match in _BOUNDARY.finditer(buffer):
+            # A boundary touching the end of the buffer might keep going in the next block
+            if block and match.end() == len(buffer):
+                break
+            yield buffer[start:match.end()], match.group().count("\n") >= 2
+            start = match.end()
+        buffer = buffer[start:]
+
+        while len(buffer) > max_segment_chars:
+            cut = buffer.rfind(" ", 0, max_segment_chars) + 1 or max_segment_chars
+            yield buffer[:cut], False
+            buffer = buffer[cut:]
+
+        if not block:
+            if buffer:
+                yield buffer, True
+            return
+
+
+# Where to cut tokens[start:] so the piece is at most `end - start` tokens and doesn't split a character: a
+# multi-byte character can be spread over several tokens, and decoding only some of them gives U+FFFD.
+# A single character longer than that goes whole.
+def _character_cut(encoding, tokens, start, end):
+    end = min(end, len(tokens))
+    for cut in [*range(end, start, -1), *range(end + 1, len(tokens) + 1)]:
+        try:
+            encoding.decode_bytes(tokens[start:cut]).decode("utf-8")
+        except UnicodeDecodeError:
+            continue
+        return cut
+    return len(tokens)
+
+
+# Stream a text file as token-bounded windows, each at most max_tokens long.
+# Consecutive windows share up to `overlap` tokens of trailing context. Windows end on a paragraph
+# break when one falls in the back half of the window, otherwise on a sentence boundary, and only
+# fall back to cutting mid-sentence when a single sentence is longer than the window.
+def iter_token_chunks(file_path, model, max_tokens, overlap=0, block_size=1 << 16):
+    with open(file_path, encoding="utf-8") as f:
+        yield from iter_text_chunks(f, model, max_tokens, overlap, block_size)
+
+
+# Same as iter_token_chunks, but for any open text stream (a file, io.StringIO, sys.stdin...)
+def iter_text_chunks(file, model, max_tokens, overlap=0, block_size=1 << 16):
+    if max_tokens <= 0 or not 0 <= overlap < max_tokens:
+        raise ValueError("max_tokens must be positive and overlap must be smaller than max_tokens")
+
+    encoding = get_encoding(model)
+    # Entries are [text, tokens, ends_paragraph]; the first `carried` entries are overlap from the last window
+    window = deque()
+    window_tokens = 0
+    carried = 0
+
+    def measure(entries):
+        chunk = "".join(entry[0] for entry in entries).strip()
+        return chunk, len(encoding.encode_ordinary(chunk))
+
+    def flush(final=False):
+        nonlocal window, window_tokens, carried
+        entries = list(window)
+
+        # Prefer ending the window on a paragraph break, as long as it keeps at least half the budget
+        cut = len(entries)
+        running = 0
+        for i, entry in enumerate(entries[:-1]):
+            running += entry[1]
+            if not final and i >= carried and entry[2] and running >= max_tokens // 2:
+                cut = i + 1
+
+        # The entries' counts only add up to roughly the chunk's: text cut on token edges and a chunk with its
+        # leading whitespace stripped both encode differently on their own. So measure the chunk itself, and hand
+        # entries back to the next window until it fits.
+        chunk, chunk_tokens = measure(entries[:cut])
+        while chunk_tokens > max_tokens and cut > carried + 1:
+            cut -= 1
+            chunk, chunk_tokens = measure(entries[:cut])
+        emitted, rest = entries[:cut], entries[cut:]
+
+        if chunk_tokens > max_tokens:
+            # Down to the overlap and one new entry, and still over: drop the overlap (the last chunk has it
+            # already), and if the entry alone is over, cut it short and put the remainder back
+            emitted = emitted[carried:]
+            chunk, chunk_tokens = measure(emitted)
+            if chunk_tokens > max_tokens:
+                text, _, ends_paragraph = emitted[0]
+                tokens = encoding.encode_ordinary(text.lstrip())
+                end = _character_cut(encoding, tokens, 0, max_tokens)
+                while True:
+                    chunk, chunk_tokens = measure([[encoding.decode(tokens[:end])]])
+                    shorter = _character_cut(encoding, tokens, 0, end - 1)
+                    if chunk_tokens <= max_tokens or shorter >= end:
+                        break
+                    end = shorter
+                remainder = encoding.decode(tokens[end:])
+                emitted = [[encoding.decode(tokens[:end]), end, False]]
+                rest.insert(0, [remainder, len(encoding.encode_ordinary(remainder)), ends_paragraph])
+
+        carry = []
+        carry_tokens = 0
+        for entry in reversed(emitted):
+            if carry_tokens + entry[1] > overlap:
+                break
+            carry.insert(0, entry)
+            carry_tokens += entry[1]
+
+        window = deque(carry + rest)
+        window_tokens = sum(entry[1] for entry in window)
+        carried = len(carry)
+        return chunk
+
+    for segment, ends_paragraph in _iter_segments(file, block_size, max_tokens * 8):
+        tokens = encoding.encode_ordinary(segment)
+        if len(tokens) <= max_tokens:
+            pieces = [(segment, len(tokens), ends_paragraph)]
+        else:
+            # One sentence is bigger than a whole window, so split it on token edges instead. The pieces are a
+            # fraction of the window, so a window that comes out over once measured can give one back and still
+            # be mostly full.
+            step = max(1, (max_tokens - overlap) // 4)
+            pieces = []
+            start = 0
+            while start < len(tokens):
+                end = _character_cut(encoding, tokens, start, start + step)
+                pieces.append((encoding.decode(tokens[start:end]), end - start, False))
+                start = end
+            pieces[-1] = (pieces[-1][0], pieces[-1][1], ends_paragraph)
+
+        for text, count, piece_ends_paragraph in pieces:
+            while window_tokens + count > max_tokens and len(window) > carried:
+                chunk = flush()
+                if chunk:
+                    yield chunk
+            # Only overlap is left and it still doesn't fit, so give up the oldest of it
+            while window_tokens + count > max_tokens and window:
+                window_tokens -= window.popleft()[1]
+                carried -= 1
+            window.append([text, count, piece_ends_paragraph])
+            window_tokens += count
+
+    while len(window) > carried:
+        chunk = flush(final=True)
+        if chunk:
+            yield chunk
+
+
+# Find a model's entry in one of the tables above, falling back to the longest matching prefix
+def _lookup_model(table, model):
+    if model in table:
+        return table[model]
+    for name in sorted(table, key=len, reverse=True):
+        if model.startswith(name + "-"):
+            return table[name]
+    return None
+
+
+# Look up the context window and completion limit for a model
+def get_model_limits(model):
+    limits = _lookup_model(MODEL_LIMITS, model)
+    if limits is None:
+        raise KeyError(f"No context limits known for model {model!r}, add it to MODEL_LIMITS")
+    return limits
+
+
+# Work out how much of a payload fits in one call to `model`, after the instructions and the completion
+# budget are taken out of the context window. The payload is sent as its own message after the instructions,
+# the way the summarizer and sentiment analyzer already build their requests.
+# The completion is capped at half the context window (some models, like gpt-4, allow a completion as long as the
+# whole window), and shrunk further if long instructions leave no room for the payload.
+# Returns a dict with the token accounting and `calls`: the payload split into pieces that each fit in one
+# request (a single piece when everything fits). Raises ValueError only if the instructions alone don't fit.
+def plan_request(model, instructions, payload, completion_tokens):
+    limits = get_model_limits(model)
+    completion_tokens = min(completion_tokens, limits["max_output_tokens"], limits["context_window"] // 2)
+
+    prompt_tokens = TOKENS_PER_REPLY + TOKENS_PER_MESSAGE * 2 + getInputTokenSize(model, instructions)[0]
+    room = limits["context_window"] - prompt_tokens
+    if room < 2:
+        raise ValueError(f"Instructions of {prompt_tokens} tokens don't fit in {model}'s "
+                         f"{limits['context_window']} token context window")
+    if completion_tokens >= room:
+        # Split what the instructions leave between the payload and the completion
+        completion_tokens = room // 2
+    payload_budget = room - completion_tokens
+
+    payload_tokens = getInputTokenSize(model, payload)[0]
+    if payload_tokens <= payload_budget:
+        calls = [payload]
+    else:
+        calls = list(iter_text_chunks(io.StringIO(payload), model, payload_budget))
+
+    return {
+        "model": model,
+        "context_window": limits["context_window"],
+        "prompt_tokens": prompt_tokens,
+        "payload_tokens": payload_tokens,
+        "payload_budget": payload_budget,
+        "completion_tokens": completion_tokens,
+        "fits": len(calls) == 1,
+        "calls": calls,
+    }
+
+
+# Read an image's width and height from its header, without decoding the image.
+# Handles PNG, GIF, WebP and JPEG (where the size sits in the first SOF segment, after any EXIF data).
+def _read_image_size(file):
+    data = file.read(32)
+
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return struct.unpack(">II", data[16:24])
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return struct.unpack("<HH", data[6:10])
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        if data[12:16] == b"VP8 ":
+            width, height = struct.unpack("<HH", data[26:30])
+            return width & 0x3FFF, height & 0x3FFF
+        if data[12:16] == b"VP8L":
+            bits = int.from_bytes(data[21:25], "little")
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if data[12:16] == b"VP8X":
+            return int.from_bytes(data[24:27], "little") + 1, int.from_bytes(data[27:30], "little") + 1
+    if data[:2] == b"\xff\xd8":
+        data = data[2:]
+
+        def take(n):
+            nonlocal data
+            while len(data) < n:
+                more = file.read(4096)
+                if not more:
+                    raise ValueError("JPEG ended before its size was found")
+                data += more
+            taken, data = data[:n], data[n:]
+            return taken
+
+        while True:
+            if take(1) != b"\xff":
+                raise ValueError("Malformed JPEG marker")
+            marker = take(1)[0]
+            while marker == 0xFF:
+                marker = take(1)[0]
+            # Standalone markers have no length field
+            if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+                continue
+            length = struct.unpack(">H", take(2))[0]
+            # Start-of-frame markers, skipping DHT (C4), JPG (C8) and DAC (CC), which share the range
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                height, width = struct.unpack(">xHH", take(5))
+                return width, height
+            take(length - 2)
+
+    raise ValueError("Unsupported image format, expected PNG, JPEG, GIF or WebP")
+
+
+# Get (width, height) for an image given as a file path, raw bytes, a base64 data URL or an http(s) URL.
+# Only the header is read, so remote images are streamed just far enough to find their size.
+def image_dimensions(image):
+    if isinstance(image, (bytes, bytearray)):
+        return _read_image_size(io.BytesIO(image))
+
+    image = str(image)
+    if image.startswith("data:"):
+        return _read_image_size(io.BytesIO(base64.b64decode(image.split(",", 1)[1])))
+    if image.startswith(("http://", "https://")):
+        # Only needed for remote images, so don't make every token count pay for importing it
+        import requests
+
+        with requests.get(image, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            return _read_image_size(response.raw)
+
+    with open(image, "rb") as f:
+        return _read_image_size(f)
+
+
+# Estimate the input tokens for an image of the given size, using the tile-based accounting:
+# detail="low" is a flat base cost, otherwise the image is fit inside 2048x2048, scaled down so its short side
+# is at most 768px, and billed per 512px tile on top of the base cost. "auto" is estimated as "high",
+# since that's the most the model can choose.
+def estimate_image_tokens(width, height, detail="auto", model="gpt-4o"):
+    costs = _lookup_model(IMAGE_TOKEN_COSTS, model) or DEFAULT_IMAGE_TOKEN_COST
+    if detail == "low":
+        return costs["base"]
+    if detail not in ("high", "auto"):
+        raise ValueError(f"detail must be 'low', 'high' or 'auto', not {detail!r}")
+
+    if max(width, height) > 2048:
+        scale = 2048 / max(width, height)
+        width, height = width * scale, height * scale
+    if min(width, height) > 768:
+        scale = 768 / min(width, height)
+        width, height = width * scale, height * scale
+
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return costs["base"] + costs["tile"] * tiles
+
+
+# Get input size in tokens for an image, reading only as much of it as needed to find its dimensions
+def getImageTokenSize(model, image, detail="auto"):
+    width, height = image_dimensions(image)
+    return estimate_image_tokens(width, height, detail, model)
+
+
+# Download the BPE files for the given encodings (by default, every encoding the models in MODEL_LIMITS use)
+# into ENCODING_CACHE_DIR. Run this once on a machine with internet access, then copy the directory to
+# air-gapped hosts; tiktoken reads the files from there and never goes to the network.
+def vendor_encodings(encoding_names=None):
+    if encoding_names is None:
+        encoding_names = sorted({tiktoken.model.encoding_name_for_model(model) for model in MODEL_LIMITS})
+    ENCODING_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    for name in encoding_names:
+        tiktoken.get_encoding(name)
+    return encoding_names
+
+
+# Load the encodings for the given models (by default, all of MODEL_LIMITS) into the registry.
+# Call this at process start so the first real request doesn't pay for reading and parsing the BPE files.
+def warm_up(models=None):
+    for model in models or MODEL_LIMITS:
+        # Encoding something small also builds anything tiktoken sets up lazily
+        get_encoding(model).encode_ordinary("warm up")
+
+
+if __name__ == "__main__":
+    # python token_splitter.py vendor  -> fetch the BPE files into the project's cache directory
+    # python token_splitter.py warm    -> check every encoding loads from the cache
+    command = sys.argv[1] if len(sys.argv) > 1 else "warm"
+    if command == "vendor":
+        print("Vendored", ", ".join(vendor_encodings()), "into", ENCODING_CACHE_DIR)
+    elif command == "warm":
+        warm_up()
+        print("Loaded encodings for", len(MODEL_LIMITS), "models from", ENCODING_CACHE_DIR)
+    else:
+        sys.exit("Usage: python token_splitter.py [vendor|warm]")
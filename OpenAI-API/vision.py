@@ -1,16 +1,7 @@
-import os
-from pathlib import Path
-from dotenv import load_dotenv
-from openai import OpenAI
+import client_factory
 
-# Get environment variables
-path = Path("Environment-Variables/.env")
-load_dotenv(dotenv_path=path)
-
-# Set up openai client
-client = OpenAI(
-    api_key=os.getenv("api_key")
-)
+# Set up openai client (shared with the rest of the project)
+client = client_factory.get_client()
 
 response = client.chat.completions.create(
     model="gpt-4-vision-preview",